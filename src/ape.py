@@ -1,76 +1,271 @@
-import json
-import os
+import logging
 
-import boto3
-from botocore.config import Config
 from dotenv import load_dotenv
 
-load_dotenv()
+from bedrock import cacheable_prefix_content, get_bedrock_client, invoke_model
+from concurrency import bounded_map
+from dataset import DatasetEvaluator, load_dataset, prompt_key
+from guide import select_guide
+from tag_stream import extract_numbered_tags
+from template import compile_template
+from usage import Budget, track_usage
+from validators import CandidateValidator
 
-# Get the directory where the current script is located
-current_script_path = os.path.dirname(os.path.abspath(__file__))
+load_dotenv()
 
-# Construct the full path to the file
-prompt_guide_path = os.path.join(current_script_path, "PromptGuide.md")
+logger = logging.getLogger(__name__)
 
-# Open the file using the full path
-with open(prompt_guide_path, "r") as f:
-    PromptGuide = f.read()
+# Static leading part of every rewrite request, kept identical across calls for
+# the same guide so it can be served from the provider's prompt cache.
+guide_prompt_prefix = """
+You are a instruction engineer. Your task is to rewrite the initial instruction in <instruction> xml tag based on the suggestions in the instruction guide in <guide> xml tag.
 
-region_name = os.getenv("REGION_NAME")
+Instruction guide:
+<guide>
+{guide}
+</guide>
+""".strip()
 
-session = boto3.Session()
-retry_config = Config(
-    region_name=region_name,
-    retries={
-        "max_attempts": 5,
-        "mode": "standard",
-    },
-)
-service_name = "bedrock-runtime"
-bedrock_client = session.client(service_name=service_name, config=retry_config)
+bedrock_client = get_bedrock_client()
 
 from rater import Rater
 
 
 class APE:
-    def __init__(self):
-        self.rater = Rater()
-
-    def __call__(self, initial_prompt, epoch, demo_data):
-        candidates = []
-        for _ in range(2):
-            candidates.append(self.rewrite(initial_prompt))
-        candidates_raw = candidates.copy()
-        customizable_variable_list = list(demo_data.keys())
-        candidates = [
-            {"prompt": candidate}
-            for candidate in candidates
-            if all(
-                [
-                    customizable_variable in candidate
-                    for customizable_variable in customizable_variable_list
-                ]
-            )
-        ]
+    def __init__(
+        self,
+        max_workers=None,
+        guide_variant=None,
+        batched=False,
+        population=2,
+        rater_mode=None,
+        validators=None,
+    ):
+        # max_workers bounds concurrent model calls, 1 runs them sequentially
+        self.max_workers = max_workers
+        # full / short / relevant / auto, see guide.resolve_guide_variant
+        self.guide_variant = guide_variant
+        # batched asks for all initial candidates in one request
+        self.batched = batched
+        # Number of initial candidates; larger populations need a tournament
+        # rater_mode (see tournament.tournament_modes)
+        self.population = population
+        self.rater = Rater(max_workers=max_workers, mode=rater_mode)
+        # Local checks that reject candidates before they reach the rater,
+        # see validators.default_validators
+        self.validator = CandidateValidator(validators)
+
+    def __call__(self, initial_prompt, epoch, demo_data, guide_variant=None):
+        guide_variant = guide_variant or self.guide_variant
+        # Keep the initial prompt when the validator rejected every rewrite
+        candidates = self.initial_candidates(
+            initial_prompt, demo_data, guide_variant
+        ) or [{"prompt": initial_prompt}]
         best_candidate = self.rater(initial_prompt, candidates, demo_data)
         for _ in range(epoch):
             more_candidate = self.generate_more(
-                initial_prompt, candidates[best_candidate]["prompt"]
+                initial_prompt, candidates[best_candidate]["prompt"], guide_variant
+            )
+            passed, _ = self.validator(
+                [more_candidate],
+                initial_prompt,
+                variables=list(demo_data.keys()),
+                accepted=[candidates[best_candidate]["prompt"]],
             )
+            if not passed:
+                continue
             candidates = [candidates[best_candidate]] + [{"prompt": more_candidate}]
             best_candidate = self.rater(initial_prompt, candidates, demo_data)
         return candidates[best_candidate]
 
-    def rewrite(self, initial_prompt):
-        prompt = """
-You are a instruction engineer. Your task is to rewrite the initial instruction in <instruction> xml tag based on the suggestions in the instruction guide in <guide> xml tag.
+    def search(
+        self,
+        initial_prompt,
+        demo_data,
+        max_epochs=10,
+        fan_out=2,
+        parents=1,
+        patience=2,
+        max_calls=None,
+        max_tokens=None,
+        guide_variant=None,
+    ):
+        """
+        Population search: each epoch the top `parents` candidates get
+        `fan_out` generate_more children each, the children are ranked against
+        the surviving population with the rater's tournament, and the best
+        self.population candidates survive.
 
-Instruction guide:
-<guide>
-{guide}
-</guide>
+        Stops after `max_epochs`, when the incumbent has stayed on top for
+        `patience` epochs in a row, or when the `max_calls`/`max_tokens`
+        budget is used up. `max_calls` is a hard cap: the initial population,
+        the number of children and so the tournament size are cut down before
+        each step so that its worst-case call count fits in what is left.
+        `max_tokens` is only checked between steps, so the step in flight may
+        overrun it. Survivors keep their outputs, so they are never re-run,
+        and pairwise judgements are deterministic and served from the
+        response cache when the same pair meets again.
+
+        Returns a dict with the `best` candidate, the final `population`, the
+        number of `epochs` run, the `stop_reason` and the `usage` snapshot.
+        """
+        guide_variant = guide_variant or self.guide_variant
+        variables = list(demo_data.keys())
+        budget = Budget(max_calls=max_calls, max_tokens=max_tokens)
+        stop_reason = "max_epochs"
+        epochs = 0
+        population = [{"prompt": initial_prompt}]
+        with track_usage(budget.meter):
+            # Rewrites (plus the batched request), their outputs and the
+            # tournament over them
+            size = budget.fit(
+                self.population,
+                lambda n: n
+                + (1 if self.batched else 0)
+                + self.rater.rank_calls(n, pending_outputs=n),
+            )
+            if size == 0:
+                stop_reason = "budget"
+            else:
+                population = (
+                    self.initial_candidates(
+                        initial_prompt, demo_data, guide_variant, n=size
+                    )
+                    or population
+                )
+                population = [
+                    population[idx]
+                    for idx in self.rater.rank(initial_prompt, population, demo_data)
+                ][: self.population]
+            streak = 0
+            while stop_reason != "budget" and epochs < max_epochs:
+                if budget.exhausted():
+                    stop_reason = "budget"
+                    break
+                # Each child costs a generate_more call and its output, then
+                # the whole pool plays the tournament
+                parent_pool = population[:parents]
+                size = budget.fit(
+                    len(parent_pool) * fan_out,
+                    lambda k: 2 * k
+                    + self.rater.rank_calls(len(population) + k, pending_outputs=k),
+                )
+                if size == 0:
+                    stop_reason = "budget"
+                    break
+                children = bounded_map(
+                    lambda parent: self.generate_more(
+                        initial_prompt, parent["prompt"], guide_variant
+                    ),
+                    [parent_pool[idx % len(parent_pool)] for idx in range(size)],
+                    max_workers=self.max_workers,
+                )
+                children, _ = self.validator(
+                    children,
+                    initial_prompt,
+                    variables=variables,
+                    accepted=[candidate["prompt"] for candidate in population],
+                )
+                children = [{"prompt": child} for child in children]
+                if budget.exhausted():
+                    # The children cannot be scored within budget
+                    stop_reason = "budget"
+                    break
+                epochs += 1
+                incumbent = population[0]
+                pool = population + children
+                ranking = self.rater.rank(initial_prompt, pool, demo_data)
+                population = [pool[idx] for idx in ranking][: self.population]
+                streak = streak + 1 if population[0] is incumbent else 0
+                if streak >= patience:
+                    stop_reason = "patience"
+                    break
+        return {
+            "best": population[0],
+            "population": population,
+            "epochs": epochs,
+            "stop_reason": stop_reason,
+            "usage": budget.meter.snapshot(),
+        }
+
+    def evaluate_dataset(
+        self,
+        initial_prompt,
+        dataset,
+        checkpoint_path=None,
+        guide_variant=None,
+        race=False,
+    ):
+        """
+        Rewrite `initial_prompt` into self.population candidates and score
+        each against the initial prompt over every row of `dataset` (a .jsonl
+        or .csv path, or a list of demo_data dicts). Returns the
+        DatasetEvaluator results, best win rate first; with `race` losing
+        candidates are dropped early and the DatasetEvaluator.race report is
+        returned instead.
 
+        The generated candidates are saved to the checkpoint, so resuming
+        with the same `checkpoint_path` scores the same candidates instead
+        of sampling new ones.
+        """
+        rows = load_dataset(dataset) if isinstance(dataset, str) else dataset
+        guide_variant = guide_variant or self.guide_variant
+        evaluator = DatasetEvaluator(
+            self.rater, max_workers=self.max_workers, checkpoint_path=checkpoint_path
+        )
+        key = prompt_key(f"{guide_variant}\0{initial_prompt}")
+        candidates = evaluator.checkpoint.candidates.get(key)
+        if candidates is None:
+            candidates = [
+                candidate["prompt"]
+                for candidate in self.initial_candidates(
+                    initial_prompt, rows[0], guide_variant
+                )
+            ]
+            # Nothing to resume when the validator rejected every rewrite
+            if candidates:
+                evaluator.checkpoint.put_candidates(key, candidates)
+        if race:
+            return evaluator.race(initial_prompt, candidates, rows)
+        return evaluator(initial_prompt, candidates, rows)
+
+    def initial_candidates(self, initial_prompt, demo_data, guide_variant=None, n=None):
+        """
+        Rewrite the initial prompt into `n` (self.population by default)
+        candidates, dropping the ones rejected by self.validator (e.g. a lost
+        demo_data variable).
+        """
+        n = n or self.population
+        if self.batched:
+            candidates = self.rewrite_batch(
+                initial_prompt,
+                n,
+                guide_variant,
+                variables=list(demo_data.keys()),
+            )
+        else:
+            # The rewrites are independent, so fan them out
+            candidates = bounded_map(
+                lambda prompt: self.rewrite(prompt, guide_variant),
+                [initial_prompt] * n,
+                max_workers=self.max_workers,
+            )
+        candidates, rejected = self.validator(
+            [candidate for candidate in candidates if candidate],
+            initial_prompt,
+            variables=list(demo_data.keys()),
+        )
+        if not candidates:
+            logger.warning(
+                "All %d candidate prompts were rejected: %s",
+                len(rejected),
+                "; ".join(reason for _, reason in rejected),
+            )
+        return [{"prompt": candidate} for candidate in candidates]
+
+    def rewrite(self, initial_prompt, guide_variant=None):
+        guide = select_guide(guide_variant or self.guide_variant, initial_prompt)
+        prompt = """
 You are a instruction engineer. Your task is to rewrite the initial instruction in <instruction> xml tag based on the suggestions in the instruction guide in <guide> xml tag.
 which is included using double pointed brackets is customizable text that will be replaced at runtime. This needs to be kept as is.
 Please same language as the initial instruction for rewriting.
@@ -85,48 +280,91 @@ Please only output the rewrite result.
         messages = [
             {
                 "role": "user",
-                "content": prompt.format(guide=PromptGuide, initial=initial_prompt),
+                "content": cacheable_prefix_content(
+                    guide_prompt_prefix.format(guide=guide),
+                    prompt.format(initial=initial_prompt),
+                ),
             }  # ,{
             #   "role": "assistant",
             #   "content": "{"
             # }
         ]
-        body = json.dumps(
-            {
-                "messages": messages,
-                "max_tokens": 1000,
-                "temperature": 0.8,
-                "top_k": 50,
-                "top_p": 1,
-                "stop_sequences": ["\n\nHuman:"],
-                "anthropic_version": "bedrock-2023-05-31",
-            }
-        )
+        body = {
+            "messages": messages,
+            "max_tokens": 1000,
+            "temperature": 0.8,
+            "top_k": 50,
+            "top_p": 1,
+            "stop_sequences": ["\n\nHuman:"],
+            "anthropic_version": "bedrock-2023-05-31",
+        }
         modelId = "anthropic.claude-3-sonnet-20240229-v1:0"  # anthropic.claude-3-sonnet-20240229-v1:0 "anthropic.claude-3-haiku-20240307-v1:0"
-        accept = "application/json"
-        contentType = "application/json"
+        response_body = invoke_model(bedrock_client, body, modelId)
+        return self.post_process(response_body["content"][0]["text"])
 
-        response = bedrock_client.invoke_model(
-            body=body, modelId=modelId, accept=accept, contentType=contentType
-        )
-        response_body = json.loads(response.get("body").read())
-        result = response_body["content"][0]["text"].replace("</rewrite>", "").strip()
-        if result.startswith("<instruction>"):
-            result = result[13:]
-        if result.endswith("</instruction>"):
-            result = result[:-14]
-        result = result.strip()
-        return result
-
-    def generate_more(self, initial_prompt, example):
+    def rewrite_batch(self, initial_prompt, n, guide_variant=None, variables=()):
+        """
+        Generate `n` rewrites with a single request, each in its own numbered
+        xml tag, so the guide and instruction are only sent once. Candidates
+        that are missing or lost one of `variables` are retried one by one
+        through rewrite.
+        """
+        guide = select_guide(guide_variant or self.guide_variant, initial_prompt)
         prompt = """
 You are a instruction engineer. Your task is to rewrite the initial instruction in <instruction> xml tag based on the suggestions in the instruction guide in <guide> xml tag.
+which is included using double pointed brackets is customizable text that will be replaced at runtime. This needs to be kept as is.
+Please same language as the initial instruction for rewriting.
+
+<instruction>
+{initial}
+</instruction>
 
-Instruction guide:
-<guide>
-{guide}
-</guide>
 
+Please write {n} different rewrites. Only output the rewrite results, each one in its own numbered xml tag: <rewrite_1></rewrite_1>, <rewrite_2></rewrite_2> and so on up to <rewrite_{n}></rewrite_{n}>.
+""".strip()
+        messages = [
+            {
+                "role": "user",
+                "content": cacheable_prefix_content(
+                    guide_prompt_prefix.format(guide=guide),
+                    prompt.format(initial=initial_prompt, n=n),
+                ),
+            },
+            {"role": "assistant", "content": "<rewrite_1>"},
+        ]
+        body = {
+            "messages": messages,
+            "max_tokens": min(1000 * n, 4096),
+            "temperature": 0.8,
+            "top_k": 50,
+            "top_p": 1,
+            "stop_sequences": [f"</rewrite_{n}>"],
+            "anthropic_version": "bedrock-2023-05-31",
+        }
+        modelId = "anthropic.claude-3-sonnet-20240229-v1:0"  # anthropic.claude-3-sonnet-20240229-v1:0 "anthropic.claude-3-haiku-20240307-v1:0"
+        response_body = invoke_model(bedrock_client, body, modelId)
+        text = "<rewrite_1>" + response_body["content"][0]["text"]
+        candidates = [
+            self.post_process(candidate) if candidate else None
+            for candidate in extract_numbered_tags(text, "rewrite", n)
+        ]
+        retry = [
+            idx
+            for idx, candidate in enumerate(candidates)
+            if not candidate or compile_template(candidate).unused(variables)
+        ]
+        retried = bounded_map(
+            lambda _: self.rewrite(initial_prompt, guide_variant),
+            retry,
+            max_workers=self.max_workers,
+        )
+        for idx, candidate in zip(retry, retried):
+            candidates[idx] = candidate
+        return candidates
+
+    def generate_more(self, initial_prompt, example, guide_variant=None):
+        guide = select_guide(guide_variant or self.guide_variant, initial_prompt)
+        prompt = """
 You are a instruction engineer. Your task is to rewrite the initial instruction in <instruction> xml tag based on the suggestions in the instruction guide in <guide> xml tag.
 which is included using double pointed brackets is customizable text that will be replaced at runtime. This needs to be kept as is.
 Please same language as the initial instruction for rewriting.
@@ -144,34 +382,30 @@ Please only output the rewrite result.
         messages = [
             {
                 "role": "user",
-                "content": prompt.format(
-                    guide=PromptGuide, initial=initial_prompt, demo=example
+                "content": cacheable_prefix_content(
+                    guide_prompt_prefix.format(guide=guide),
+                    prompt.format(initial=initial_prompt, demo=example),
                 ),
             }  # ,{
             #   "role": "assistant",
             #   "content": "{"
             # }
         ]
-        body = json.dumps(
-            {
-                "messages": messages,
-                "max_tokens": 1000,
-                "temperature": 0.8,
-                "top_k": 50,
-                "top_p": 1,
-                "stop_sequences": ["\n\nHuman:"],
-                "anthropic_version": "bedrock-2023-05-31",
-            }
-        )
+        body = {
+            "messages": messages,
+            "max_tokens": 1000,
+            "temperature": 0.8,
+            "top_k": 50,
+            "top_p": 1,
+            "stop_sequences": ["\n\nHuman:"],
+            "anthropic_version": "bedrock-2023-05-31",
+        }
         modelId = "anthropic.claude-3-sonnet-20240229-v1:0"  # anthropic.claude-3-sonnet-20240229-v1:0 "anthropic.claude-3-haiku-20240307-v1:0"
-        accept = "application/json"
-        contentType = "application/json"
+        response_body = invoke_model(bedrock_client, body, modelId)
+        return self.post_process(response_body["content"][0]["text"])
 
-        response = bedrock_client.invoke_model(
-            body=body, modelId=modelId, accept=accept, contentType=contentType
-        )
-        response_body = json.loads(response.get("body").read())
-        result = response_body["content"][0]["text"].replace("</rewrite>", "").strip()
+    def post_process(self, result):
+        result = result.replace("</rewrite>", "").strip()
         if result.startswith("<instruction>"):
             result = result[13:]
         if result.endswith("</instruction>"):
@@ -10,6 +10,9 @@ from metaprompt import MetaPrompt
 from optimize import Alignment
 from translate import GuideBased
 from application.soe_prompt import SOEPrompt
+from bedrock import warm_up
+from concurrency import bounded_as_completed
+from guide import default_guide_variant, get_guide_index, guide_variants
 
 
 
@@ -19,6 +22,10 @@ rewrite = GuideBased()
 alignment = Alignment()
 metaprompt = MetaPrompt()
 soeprompt = SOEPrompt()
+# Pre-open pooled Bedrock connections (BEDROCK_WARMUP_CONNECTIONS, 0 disables)
+warm_up()
+# Build (or load the persisted) guide section index for the relevant variant
+get_guide_index()
 # Load environment variables
 load_dotenv()
 language = os.getenv("LANGUAGE", "en")
@@ -29,38 +36,202 @@ with open('translations.json', 'r', encoding='utf-8') as f:
 
 
     
-def generate_prompt(original_prompt, level):
-    if level == "One-time Generation":
-        result = rewrite(original_prompt)
-        return [
+def judge_candidates(candidates, guide_variant):
+    judge_result, assignment = rewrite.judge_clusters(
+        candidates, guide_variant=guide_variant
+    )
+    textboxes = []
+    for i in range(3):
+        # Near duplicates of the winner share its verdict
+        is_best = (
+            "Y" if judge_result is not None and assignment[i] == judge_result else "N"
+        )
+        textboxes.append(
             gr.Textbox(
-                label=lang_store[language]["Prompt Template Generated"],
-                value=result,
+                label=(
+                    f"{lang_store[language]['Prompt Template Generated']} "
+                    f"#{i+1} {is_best}"
+                ),
+                value=candidates[i],
                 lines=3,
                 show_copy_button=True,
+                visible=True,
                 interactive=False,
             )
-        ] + [gr.Textbox(visible=False)] * 2
-    elif level == "Multiple-time Generation":
-        candidates = []
-        for i in range(3):
-            result = rewrite(original_prompt)
-            candidates.append(result)
-        judge_result = rewrite.judge(candidates)
-        textboxes = []
-        for i in range(3):
-            is_best = "Y" if judge_result == i else "N"
-            textboxes.append(
+        )
+    yield textboxes
+
+
+def generate_prompt(original_prompt, level, guide_variant, regenerate=False):
+    if level == "One-time Generation":
+        # The semantic cache would hand back the previous rewrite for the same
+        # input, regenerate asks the model for a fresh one
+        for result in rewrite.stream(
+            original_prompt,
+            use_cache=False if regenerate else None,
+            guide_variant=guide_variant,
+        ):
+            yield [
                 gr.Textbox(
-                    label=f"{lang_store[language]['Prompt Template Generated']} #{i+1} {is_best}",
-                    value=candidates[i],
+                    label=lang_store[language]["Prompt Template Generated"],
+                    value=result,
                     lines=3,
                     show_copy_button=True,
-                    visible=True,
                     interactive=False,
                 )
+            ] + [gr.Textbox(visible=False)] * 2
+    elif level == "Batched Multiple-time Generation":
+        # All three candidates from one request, the guide is only sent once
+        candidates = rewrite.generate_batch(
+            original_prompt, 3, guide_variant=guide_variant
+        )
+        yield from judge_candidates(candidates, guide_variant)
+    elif level == "Multiple-time Generation":
+        # Detect the language once and generate the candidates concurrently,
+        # filling each textbox as soon as its candidate finishes.
+        lang = rewrite.detect_lang(original_prompt)
+        candidates = [None] * 3
+        textboxes = [
+            gr.Textbox(
+                label=f"{lang_store[language]['Prompt Template Generated']} #{i+1}",
+                value="",
+                lines=3,
+                show_copy_button=True,
+                visible=True,
+                interactive=False,
+            )
+            for i in range(3)
+        ]
+        yield textboxes
+        for i, result in bounded_as_completed(
+            lambda _: rewrite(
+                original_prompt,
+                lang=lang,
+                use_cache=False,
+                guide_variant=guide_variant,
+            ),
+            range(3),
+            max_workers=3,
+        ):
+            candidates[i] = result
+            textboxes[i] = gr.Textbox(
+                label=f"{lang_store[language]['Prompt Template Generated']} #{i+1}",
+                value=result,
+                lines=3,
+                show_copy_button=True,
+                visible=True,
+                interactive=False,
+            )
+            yield textboxes
+        yield from judge_candidates(candidates, guide_variant)
+
+def batch_evaluate(
+    dataset, original_prompt, eval_prompt, openai_model_id, aws_model_id, eval_model_id
+):
+    for progress in alignment.evaluate_dataset(
+        original_prompt,
+        eval_prompt,
+        dataset,
+        openai_model_id,
+        aws_model_id,
+        eval_model_id,
+    ):
+        status = (
+            f"{progress['rows']} rows, {progress['errors']} errors "
+            f"-> {progress['results_path']}"
+        )
+        yield status, progress.get("summary", ""), progress.get("revised_prompt") or ""
+
+def invoke_prompt(
+    original_prompt_replace,
+    revised_prompt_replace,
+    original_prompt,
+    revised_prompt,
+    openai_model_id,
+    aws_model_id,
+    openai_reference,
+):
+    # The OpenAI output box may end up holding an error or partial output, so
+    # only a response that completed is kept as the auto-align reference,
+    # together with the prompt and model it came from
+    openai_prompt = original_prompt_replace or original_prompt
+    results, failed = ["", ""], [True, True]
+    for results, failed in alignment.stream_prompts(
+        openai_prompt,
+        revised_prompt_replace or revised_prompt,
+        openai_model_id,
+        aws_model_id,
+    ):
+        yield results[0], results[1], openai_reference
+    if not failed[0] and results[0]:
+        openai_reference = {
+            "prompt": openai_prompt,
+            "model": openai_model_id,
+            "output": results[0],
+        }
+    yield results[0], results[1], openai_reference
+
+
+def auto_align(
+    original_prompt,
+    kv_original,
+    eval_prompt,
+    kv_eval,
+    openai_model_id,
+    aws_model_id,
+    eval_model_id,
+    max_rounds,
+    openai_reference,
+):
+    # Reuse the last reference only when it answered this exact prompt with
+    # this model, otherwise auto_align generates a fresh one
+    openai_prompt = alignment.insert_kv(original_prompt, kv_original)
+    reference = None
+    if openai_reference and (openai_reference["prompt"], openai_reference["model"]) == (
+        openai_prompt,
+        openai_model_id,
+    ):
+        reference = openai_reference["output"]
+    for result in alignment.auto_align(
+        original_prompt,
+        kv_original,
+        eval_prompt,
+        kv_eval,
+        openai_model_id,
+        aws_model_id,
+        eval_model_id,
+        max_rounds=int(max_rounds),
+        openai_reference=reference,
+    ):
+        if "stop_reason" in result:
+            status = (
+                f"{result['stop_reason']} after {result['rounds']} rounds, "
+                f"best similarity {result['best_similarity']:.2f} "
+                f"-> {result['artifacts_path']}"
+            )
+            openai_reference = {
+                "prompt": openai_prompt,
+                "model": openai_model_id,
+                "output": result["reference"],
+            }
+            yield (
+                result["reference"],
+                gr.update(),
+                gr.update(),
+                result["best_prompt"],
+                status,
+                openai_reference,
+            )
+        else:
+            status = f"round {result['round']}: similarity {result['similarity']:.2f}"
+            yield (
+                gr.update(),
+                result["bedrock"],
+                result.get("evaluation", ""),
+                result.get("revised_prompt", result["prompt"]),
+                status,
+                openai_reference,
             )
-        return textboxes
 
 def ape_prompt(original_prompt, user_data):
     result = ape(original_prompt, 1, json.loads(user_data))
@@ -104,7 +275,7 @@ with gr.Blocks(title=lang_store[language]["Automatic Prompt Engineering"], theme
             interactive=False,
         )
         metaprompt_button.click(
-            metaprompt,
+            metaprompt.stream,
             inputs=[original_task, variables],
             outputs=[prompt_result, variables_result],
         )
@@ -119,10 +290,25 @@ with gr.Blocks(title=lang_store[language]["Automatic Prompt Engineering"], theme
         with gr.Row():
             with gr.Column(scale=2):
                 level = gr.Radio(
-                    ["One-time Generation", "Multiple-time Generation"],
+                    [
+                        "One-time Generation",
+                        "Multiple-time Generation",
+                        "Batched Multiple-time Generation",
+                    ],
                     label=lang_store[language]["Optimize Level"],
                     value="One-time Generation",
                 )
+                guide_variant = gr.Radio(
+                    guide_variants,
+                    label=lang_store[language]["Guide Variant"],
+                    info=lang_store[language][
+                        "auto uses the short guide for short prompts"
+                    ],
+                    value=default_guide_variant,
+                )
+                regenerate = gr.Checkbox(
+                    label=lang_store[language]["Regenerate (skip caches)"], value=False
+                )
                 b1 = gr.Button(lang_store[language]["Generate Prompt"])
                 textboxes = []
                 for i in range(3):
@@ -135,7 +321,11 @@ with gr.Blocks(title=lang_store[language]["Automatic Prompt Engineering"], theme
                         visible=False if i > 0 else True,
                     )
                     textboxes.append(t)
-                b1.click(generate_prompt, inputs=[original_prompt, level], outputs=textboxes)
+                b1.click(
+                    generate_prompt,
+                    inputs=[original_prompt, level, guide_variant, regenerate],
+                    outputs=textboxes,
+                )
 
     with gr.Tab(lang_store[language]["Prompt Evaluation"]):
         with gr.Row():
@@ -221,8 +411,10 @@ with gr.Blocks(title=lang_store[language]["Automatic Prompt Engineering"], theme
                 show_copy_button=True,
             )
 
+            # Last complete OpenAI response with the prompt and model it answered
+            openai_reference = gr.State(None)
             invoke_button.click(
-                alignment.invoke_prompt,
+                invoke_prompt,
                 inputs=[
                     user_prompt_original_replaced,
                     user_prompt_eval_replaced,
@@ -230,8 +422,9 @@ with gr.Blocks(title=lang_store[language]["Automatic Prompt Engineering"], theme
                     user_prompt_eval,
                     openai_model_dropdown,
                     aws_model_dropdown,
+                    openai_reference,
                 ],
-                outputs=[openai_output, aws_output],
+                outputs=[openai_output, aws_output, openai_reference],
             )
 
         with gr.Row():
@@ -272,6 +465,73 @@ with gr.Blocks(title=lang_store[language]["Automatic Prompt Engineering"], theme
                 outputs=revised_prompt_output,
             )
 
+        with gr.Row():
+            auto_align_rounds = gr.Number(
+                label=lang_store[language]["Auto-align Rounds"],
+                value=3,
+                precision=0,
+                minimum=1,
+            )
+            auto_align_button = gr.Button(lang_store[language]["Auto-align"])
+            auto_align_status = gr.Textbox(
+                label=lang_store[language]["Auto-align Progress"],
+                lines=1,
+                interactive=False,
+            )
+            auto_align_button.click(
+                auto_align,
+                inputs=[
+                    user_prompt_original,
+                    kv_input_original,
+                    user_prompt_eval,
+                    kv_input_eval,
+                    openai_model_dropdown,
+                    aws_model_dropdown,
+                    eval_model_dropdown,
+                    auto_align_rounds,
+                    openai_reference,
+                ],
+                outputs=[
+                    openai_output,
+                    aws_output,
+                    feedback_input,
+                    revised_prompt_output,
+                    auto_align_status,
+                    openai_reference,
+                ],
+            )
+
+        with gr.Row():
+            batch_dataset = gr.File(
+                label=lang_store[language]["Batch Evaluation Dataset (.jsonl/.csv)"],
+                file_types=[".jsonl", ".csv"],
+                type="filepath",
+            )
+            batch_button = gr.Button(lang_store[language]["Batch Evaluate"])
+            batch_status = gr.Textbox(
+                label=lang_store[language]["Batch Evaluation Progress"],
+                lines=1,
+                interactive=False,
+            )
+            batch_summary = gr.Textbox(
+                label=lang_store[language]["Batch Evaluation Summary"],
+                lines=3,
+                interactive=False,
+                show_copy_button=True,
+            )
+            batch_button.click(
+                batch_evaluate,
+                inputs=[
+                    batch_dataset,
+                    user_prompt_original,
+                    user_prompt_eval,
+                    openai_model_dropdown,
+                    aws_model_dropdown,
+                    eval_model_dropdown,
+                ],
+                outputs=[batch_status, batch_summary, revised_prompt_output],
+            )
+
     with gr.Tab(lang_store[language]["SOE-Optimized Product Description"]):
         with gr.Row():
             with gr.Column():
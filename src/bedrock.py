@@ -0,0 +1,239 @@
+import json
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+from dotenv import load_dotenv
+
+from concurrency import bounded_map
+from response_cache import ResponseCache
+from usage import record_usage
+
+load_dotenv()
+
+service_name = "bedrock-runtime"
+
+# Connection pool sizing, sized for concurrent Gradio handlers fanning out model
+# calls. botocore defaults to 10 connections per client.
+max_pool_connections = int(os.getenv("BEDROCK_MAX_POOL_CONNECTIONS", "50"))
+tcp_keepalive = os.getenv("BEDROCK_TCP_KEEPALIVE", "true").lower() == "true"
+read_timeout = int(os.getenv("BEDROCK_READ_TIMEOUT", "300"))
+# Optional endpoint override, e.g. a local stub server for benchmarks.
+endpoint_url = os.getenv("BEDROCK_ENDPOINT_URL") or None
+
+# Persistent response cache, see invoke_model
+cache_enabled = os.getenv("BEDROCK_CACHE_ENABLED", "true").lower() == "true"
+cache_path = os.getenv("BEDROCK_CACHE_PATH") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".cache", "bedrock_responses.sqlite"
+)
+cache_max_entries = int(os.getenv("BEDROCK_CACHE_MAX_ENTRIES", "10000"))
+cache_ttl = int(os.getenv("BEDROCK_CACHE_TTL", str(7 * 24 * 3600)))
+
+# Provider-side prompt caching of large static prefixes (the prompt guide, the
+# metaprompt). Only enable it for model versions that support cache_control.
+prompt_cache_enabled = os.getenv("BEDROCK_PROMPT_CACHE", "false").lower() == "true"
+
+_clients = {}
+_clients_lock = threading.Lock()
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_bedrock_client(region_name=None):
+    """
+    Return the process-wide bedrock-runtime client for a region.
+
+    boto3 clients are thread-safe, so every module shares one client and one
+    connection pool instead of building its own session.
+    """
+    region_name = region_name or os.getenv("REGION_NAME")
+    with _clients_lock:
+        client = _clients.get(region_name)
+        if client is None:
+            retry_config = Config(
+                region_name=region_name,
+                retries={
+                    "max_attempts": 5,
+                    "mode": "standard",
+                },
+                max_pool_connections=max_pool_connections,
+                tcp_keepalive=tcp_keepalive,
+                read_timeout=read_timeout,
+            )
+            session = boto3.Session()
+            client = session.client(
+                service_name=service_name,
+                config=retry_config,
+                endpoint_url=endpoint_url,
+            )
+            _clients[region_name] = client
+    return client
+
+
+def warm_up(connections=None, region_name=None):
+    """
+    Open `connections` pooled connections ahead of the first real request.
+
+    Each warm-up request is an invoke_model call against a model id that does
+    not exist, which is rejected by the service without running a model but
+    still pays the TCP/TLS handshake. The requests are sent concurrently so each
+    one checks out its own connection from the pool.
+
+    Returns the number of warm-up requests that reached the endpoint.
+    """
+    if connections is None:
+        connections = int(os.getenv("BEDROCK_WARMUP_CONNECTIONS", "0"))
+    connections = min(connections, max_pool_connections)
+    if connections <= 0:
+        return 0
+    client = get_bedrock_client(region_name)
+
+    def ping(_):
+        try:
+            client.invoke_model(
+                body=b"{}",
+                modelId="warm-up",
+                accept="application/json",
+                contentType="application/json",
+            )
+        except ClientError:
+            # Any service error means the connection was established.
+            pass
+        except BotoCoreError:
+            return False
+        return True
+
+    return sum(bounded_map(ping, range(connections), max_workers=connections))
+
+
+def get_response_cache():
+    """Return the shared response cache, or None when caching is disabled."""
+    global _response_cache
+    if not cache_enabled:
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(
+                cache_path, max_entries=cache_max_entries, ttl=cache_ttl
+            )
+    return _response_cache
+
+
+def invoke_model(client, body, model_id, use_cache=None):
+    """
+    Invoke `model_id` with the request `body` dict and return the parsed
+    response body.
+
+    `use_cache` opts the call in or out of the response cache. The default
+    (None) caches only deterministic requests, i.e. temperature 0, so sampling
+    calls keep producing fresh candidates.
+    """
+    if use_cache is None:
+        use_cache = body.get("temperature", 1.0) == 0
+    cache = get_response_cache() if use_cache else None
+    if cache is not None:
+        key = cache.make_key(model_id, body)
+        response_body = cache.get(key)
+        if response_body is not None:
+            record_usage(model_id, response_body.get("usage"), cached_response=True)
+            return response_body
+    response = client.invoke_model(
+        body=json.dumps(body),
+        modelId=model_id,
+        accept="application/json",
+        contentType="application/json",
+    )
+    response_body = json.loads(response.get("body").read())
+    record_usage(model_id, response_body.get("usage"))
+    if cache is not None:
+        cache.put(key, model_id, response_body)
+    return response_body
+
+
+def invoke_model_stream(client, body, model_id, use_cache=None, stop_at=None):
+    """
+    Invoke `model_id` with invoke_model_with_response_stream and yield the text
+    deltas as they arrive.
+
+    Closing the generator early closes the underlying event stream. `stop_at`
+    acts as a client-side stop sequence: the stream is closed as soon as that
+    text has been generated, so no output latency is spent on the rest.
+
+    Cached responses (see invoke_model) are yielded as a single delta. A stream
+    is only written to the cache once it has ended or reached `stop_at`.
+    """
+    if use_cache is None:
+        use_cache = body.get("temperature", 1.0) == 0
+    cache = get_response_cache() if use_cache else None
+    if cache is not None:
+        # Responses cut at stop_at must not be served to callers without it
+        key = cache.make_key(
+            model_id, dict(body, stop_at=stop_at) if stop_at else body
+        )
+        response_body = cache.get(key)
+        if response_body is not None:
+            record_usage(model_id, response_body.get("usage"), cached_response=True)
+            yield response_body["content"][0]["text"]
+            return
+    response = client.invoke_model_with_response_stream(
+        body=json.dumps(body),
+        modelId=model_id,
+        accept="application/json",
+        contentType="application/json",
+    )
+    stream = response.get("body")
+    text = []
+    usage = {}
+    stop_reason = None
+    tail = ""
+    try:
+        for event in stream:
+            chunk = event.get("chunk")
+            if not chunk:
+                continue
+            chunk = json.loads(chunk.get("bytes").decode())
+            if chunk["type"] == "message_start":
+                usage.update(chunk["message"].get("usage", {}))
+            elif chunk["type"] == "content_block_delta":
+                delta = chunk["delta"].get("text", "")
+                text.append(delta)
+                yield delta
+                if stop_at:
+                    tail += delta
+                    if stop_at in tail:
+                        stop_reason = "stop_at"
+                        break
+                    tail = tail[-len(stop_at) :]
+            elif chunk["type"] == "message_delta":
+                usage.update(chunk.get("usage", {}))
+                stop_reason = chunk["delta"].get("stop_reason")
+    finally:
+        stream.close()
+        record_usage(model_id, usage)
+    if cache is not None:
+        response_body = {
+            "type": "message",
+            "role": "assistant",
+            "content": [{"type": "text", "text": "".join(text)}],
+            "stop_reason": stop_reason,
+            "usage": usage,
+        }
+        cache.put(key, model_id, response_body)
+
+
+def cacheable_prefix_content(prefix, suffix):
+    """
+    Build user message content with a static `prefix` (e.g. the prompt guide)
+    followed by the per-request `suffix`.
+
+    Keeping the large unchanging text first, in its own block, makes it a
+    stable prefix; with BEDROCK_PROMPT_CACHE enabled the block carries a
+    cache breakpoint so later requests read it from the provider's prompt
+    cache instead of reprocessing it.
+    """
+    prefix_block = {"type": "text", "text": prefix}
+    if prompt_cache_enabled:
+        prefix_block["cache_control"] = {"type": "ephemeral"}
+    return [prefix_block, {"type": "text", "text": suffix}]
@@ -0,0 +1,95 @@
+"""
+Compare generating rewrite candidates one request each (concurrently, as the
+Multiple-time Generation level does) against a single batched request:
+model calls, input/output tokens, latency and how many batched candidates had
+to be retried. Runs against the configured Bedrock endpoint.
+
+    cd src
+    python -m benchmark.bench_batched_generation --candidates 3 --repeats 2
+
+`--prompts` is a text file with one prompt per blank-line separated block.
+"""
+
+import argparse
+import re
+import statistics
+import time
+
+from benchmark.bench_guide_variants import load_prompts
+from concurrency import bounded_map
+from translate import GuideBased
+from usage import track_usage
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prompts", default=None)
+    parser.add_argument("--candidates", type=int, default=3)
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--guide-variant", default=None)
+    args = parser.parse_args()
+
+    rewrite = GuideBased()
+    modes = ["per-candidate", "batched"]
+    stats = {
+        mode: {"calls": [], "input_tokens": [], "output_tokens": [], "latency": []}
+        for mode in modes
+    }
+    variables_kept = {mode: 0 for mode in modes}
+    total = 0
+    for prompt in load_prompts(args.prompts):
+        lang = rewrite.detect_lang(prompt)
+        variables = re.findall(r"{{(.*?)}}", prompt)
+        for _ in range(args.repeats):
+            for mode in modes:
+                with track_usage() as meter:
+                    start = time.perf_counter()
+                    if mode == "batched":
+                        candidates = rewrite.generate_batch(
+                            prompt,
+                            args.candidates,
+                            lang=lang,
+                            guide_variant=args.guide_variant,
+                        )
+                    else:
+                        candidates = bounded_map(
+                            lambda _: rewrite(
+                                prompt,
+                                lang=lang,
+                                use_cache=False,
+                                guide_variant=args.guide_variant,
+                            ),
+                            range(args.candidates),
+                            max_workers=args.candidates,
+                        )
+                    stats[mode]["latency"].append(time.perf_counter() - start)
+                usage = meter.snapshot()
+                stats[mode]["calls"].append(usage["calls"])
+                stats[mode]["input_tokens"].append(
+                    usage["total_tokens"] - usage["output_tokens"]
+                )
+                stats[mode]["output_tokens"].append(usage["output_tokens"])
+                variables_kept[mode] += sum(
+                    all("{{" + variable + "}}" in candidate for variable in variables)
+                    for candidate in candidates
+                    if candidate
+                )
+            total += args.candidates
+
+    print(
+        f"{'mode':<15}{'calls':>7}{'input tokens':>14}{'output tokens':>15}"
+        f"{'latency p50':>13}{'vars kept':>11}"
+    )
+    for mode in modes:
+        print(
+            f"{mode:<15}"
+            f"{statistics.mean(stats[mode]['calls']):>7.1f}"
+            f"{statistics.mean(stats[mode]['input_tokens']):>14.0f}"
+            f"{statistics.mean(stats[mode]['output_tokens']):>15.0f}"
+            f"{statistics.median(stats[mode]['latency']):>12.2f}s"
+            f"{variables_kept[mode] / total if total else 0.0:>11.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+First-request and steady-state latency of the shared bedrock-runtime client
+against a local stub endpoint.
+
+    cd src
+    python -m benchmark.bench_client --handshake-delay 0.05 --concurrency 32
+"""
+
+import argparse
+import json
+import os
+import statistics
+import time
+
+from benchmark.stub_server import StubBedrockHandler, start_stub_server
+
+body = json.dumps(
+    {
+        "messages": [{"role": "user", "content": "ping"}],
+        "max_tokens": 8,
+        "anthropic_version": "bedrock-2023-05-31",
+    }
+)
+
+
+def invoke(client):
+    start = time.perf_counter()
+    response = client.invoke_model(
+        body=body,
+        modelId="anthropic.claude-3-haiku-20240307-v1:0",
+        accept="application/json",
+        contentType="application/json",
+    )
+    json.loads(response.get("body").read())
+    return time.perf_counter() - start
+
+
+def run(bedrock, pool_size, warmup, concurrency, rounds):
+    from concurrency import bounded_map
+
+    # Start from a cold client for every scenario
+    bedrock._clients.clear()
+    bedrock.max_pool_connections = pool_size
+    client = bedrock.get_bedrock_client()
+    if warmup:
+        bedrock.warm_up(concurrency)
+    first = bounded_map(lambda _: invoke(client), range(concurrency), concurrency)
+    steady = []
+    for _ in range(rounds):
+        steady += bounded_map(lambda _: invoke(client), range(concurrency), concurrency)
+    return first, steady
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--handshake-delay", type=float, default=0.05)
+    parser.add_argument("--response-delay", type=float, default=0.01)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    StubBedrockHandler.handshake_delay = args.handshake_delay
+    StubBedrockHandler.response_delay = args.response_delay
+    server, endpoint = start_stub_server()
+    os.environ["BEDROCK_ENDPOINT_URL"] = endpoint
+    os.environ.setdefault("REGION_NAME", "us-east-1")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "stub")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "stub")
+
+    import bedrock
+
+    scenarios = [
+        ("default pool (10), cold", 10, False),
+        ("pool 50, cold", 50, False),
+        ("pool 50, warmed", 50, True),
+    ]
+    print(
+        f"{'scenario':<26}{'first p50':>12}{'first max':>12}"
+        f"{'steady p50':>12}{'steady p95':>12}{'conns':>8}"
+    )
+    for name, pool_size, warmup in scenarios:
+        connections = server.connections
+        first, steady = run(bedrock, pool_size, warmup, args.concurrency, args.rounds)
+        steady.sort()
+        print(
+            f"{name:<26}"
+            f"{statistics.median(first) * 1000:>10.1f}ms"
+            f"{max(first) * 1000:>10.1f}ms"
+            f"{statistics.median(steady) * 1000:>10.1f}ms"
+            f"{steady[int(len(steady) * 0.95) - 1] * 1000:>10.1f}ms"
+            f"{server.connections - connections:>8}"
+        )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
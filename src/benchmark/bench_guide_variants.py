@@ -0,0 +1,79 @@
+"""
+Compare the full, short and relevant-sections prompt guides on GuideBased
+rewrites: input tokens, latency and judge win-rate. Runs against the
+configured Bedrock endpoint.
+
+    cd src
+    python -m benchmark.bench_guide_variants --prompts prompts.txt --repeats 2
+
+`--prompts` is a text file with one prompt per blank-line separated block.
+"""
+
+import argparse
+import statistics
+import time
+
+from translate import GuideBased
+from usage import track_usage
+
+sample_prompts = [
+    'Summarize the text delimited by triple quotes.\n\n"""{{text}}"""',
+    "You are a customer support agent. Answer the question {{question}} using the "
+    "policy document {{policy}}. If the answer is not in the document, say so.",
+    "Translate the following product description into French, keeping the brand "
+    "names unchanged: {{description}}",
+]
+
+
+def load_prompts(path):
+    if not path:
+        return sample_prompts
+    with open(path, "r") as f:
+        return [block.strip() for block in f.read().split("\n\n") if block.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prompts", default=None)
+    parser.add_argument("--repeats", type=int, default=1)
+    args = parser.parse_args()
+
+    rewrite = GuideBased()
+    variants = ["full", "short", "relevant"]
+    stats = {variant: {"input_tokens": [], "latency": []} for variant in variants}
+    wins = {variant: 0 for variant in variants}
+    judged = 0
+    for prompt in load_prompts(args.prompts):
+        for _ in range(args.repeats):
+            results = {}
+            for variant in variants:
+                with track_usage() as meter:
+                    start = time.perf_counter()
+                    results[variant] = rewrite(
+                        prompt, use_cache=False, guide_variant=variant
+                    )
+                    stats[variant]["latency"].append(time.perf_counter() - start)
+                usage = meter.snapshot()
+                stats[variant]["input_tokens"].append(
+                    usage["total_tokens"] - usage["output_tokens"]
+                )
+            # Judge every rotation of the candidates to cancel position bias
+            for shift in range(len(variants)):
+                order = variants[shift:] + variants[:shift]
+                winner = rewrite.judge([results[variant] for variant in order])
+                if winner is not None:
+                    wins[order[winner]] += 1
+                    judged += 1
+
+    print(f"{'variant':<10}{'input tokens':>14}{'latency p50':>14}{'win rate':>10}")
+    for variant in variants:
+        print(
+            f"{variant:<10}"
+            f"{statistics.mean(stats[variant]['input_tokens']):>14.0f}"
+            f"{statistics.median(stats[variant]['latency']):>13.2f}s"
+            f"{wins[variant] / judged if judged else 0.0:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Compare similarity-selected metaprompt examples against the monolithic
+metaprompt.txt: latency, input tokens, prompt-cache reads and judge win-rate
+of the generated prompt templates. Runs against the configured Bedrock
+endpoint.
+
+Trade-off: the monolithic metaprompt is the same for every task, so with
+BEDROCK_PROMPT_CACHE enabled its ~6k tokens before the task are read from the
+prompt cache after the first request. Selected examples change with the task,
+so only the fixed header (~100 tokens, below the provider's minimum cacheable
+length) is a cacheable prefix and the examples are always sent uncached. Run
+with and without BEDROCK_PROMPT_CACHE to see which is cheaper for a workload.
+
+    cd src
+    python -m benchmark.bench_metaprompt_examples --top-k 2
+"""
+
+import argparse
+import statistics
+import time
+
+import bedrock
+from metaprompt import MetaPrompt
+from translate import GuideBased
+from usage import track_usage
+
+sample_tasks = [
+    (
+        "Draft an email responding to a customer complaint",
+        "CUSTOMER_COMPLAINT\nCOMPANY_NAME",
+    ),
+    ("Check whether a product review mentions shipping problems", "REVIEW"),
+    ("Explain a math word problem step by step to a student", "PROBLEM"),
+    (
+        "Answer a question about a contract and cite the relevant clauses",
+        "CONTRACT\nQUESTION",
+    ),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--top-k", type=int, default=2)
+    parser.add_argument("--token-budget", type=int, default=4000)
+    args = parser.parse_args()
+
+    # Measure real model calls, not response cache hits
+    bedrock.cache_enabled = False
+    modes = {
+        "monolithic": MetaPrompt(example_top_k=0),
+        "selected": MetaPrompt(
+            example_top_k=args.top_k, example_token_budget=args.token_budget
+        ),
+    }
+    judge = GuideBased()
+    stats = {
+        mode: {"input_tokens": [], "latency": [], "cache_read": []} for mode in modes
+    }
+    wins = {mode: 0 for mode in modes}
+    judged = 0
+    for task, variables in sample_tasks:
+        results = {}
+        for mode, metaprompt in modes.items():
+            with track_usage() as meter:
+                start = time.perf_counter()
+                results[mode], _ = metaprompt(task, variables)
+                stats[mode]["latency"].append(time.perf_counter() - start)
+            usage = meter.snapshot()
+            stats[mode]["input_tokens"].append(
+                usage["total_tokens"] - usage["output_tokens"]
+            )
+            stats[mode]["cache_read"].append(usage["cache_read_ratio"])
+        # Judge both orders to cancel position bias
+        names = list(modes)
+        for order in (names, names[::-1]):
+            winner = judge.judge([results[mode] for mode in order])
+            if winner is not None:
+                wins[order[winner]] += 1
+                judged += 1
+
+    print(
+        f"{'mode':<12}{'input tokens':>14}{'cache read':>12}"
+        f"{'latency p50':>14}{'win rate':>10}"
+    )
+    for mode in modes:
+        print(
+            f"{mode:<12}"
+            f"{statistics.mean(stats[mode]['input_tokens']):>14.0f}"
+            f"{statistics.mean(stats[mode]['cache_read']):>12.2f}"
+            f"{statistics.median(stats[mode]['latency']):>13.2f}s"
+            f"{wins[mode] / judged if judged else 0.0:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Prompt-cache instrumentation for the guide-prefixed requests against a local
+stub endpoint that echoes cache usage fields.
+
+    cd src
+    python -m benchmark.bench_prompt_cache --requests 5
+"""
+
+import argparse
+import os
+import time
+
+from benchmark.stub_server import StubBedrockHandler, start_stub_server
+
+prompt = 'Summarize the text delimited by triple quotes.\n\n"""{{text}}"""'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5)
+    parser.add_argument("--input-token-delay", type=float, default=0.00005)
+    args = parser.parse_args()
+
+    StubBedrockHandler.input_token_delay = args.input_token_delay
+    server, endpoint = start_stub_server()
+    os.environ["BEDROCK_ENDPOINT_URL"] = endpoint
+    os.environ["BEDROCK_CACHE_ENABLED"] = "false"
+    os.environ.setdefault("REGION_NAME", "us-east-1")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "stub")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "stub")
+
+    import bedrock
+    from ape import APE
+    from metaprompt import MetaPrompt
+    from translate import GuideBased
+    from usage import track_usage
+
+    ape = APE(max_workers=1)
+    rewrite = GuideBased()
+    metaprompt = MetaPrompt()
+    calls = [
+        ("GuideBased.__call__", lambda: rewrite(prompt, use_cache=False)),
+        ("GuideBased.judge", lambda: rewrite.judge(["a", "b", "c"])),
+        ("APE.rewrite", lambda: ape.rewrite(prompt)),
+        ("APE.generate_more", lambda: ape.generate_more(prompt, "example")),
+        (
+            "MetaPrompt",
+            # MetaPrompt streams and the stub only speaks InvokeModel
+            lambda: bedrock.invoke_model(
+                bedrock.get_bedrock_client(),
+                metaprompt.build_body("Draft an email", "COMPLAINT"),
+                metaprompt.model_id,
+                use_cache=False,
+            ),
+        ),
+    ]
+    print(
+        f"{'request':<22}{'prompt cache':>14}{'uncached in':>13}"
+        f"{'cache read':>12}{'cache write':>13}{'avg latency':>13}"
+    )
+    for enabled in (False, True):
+        bedrock.prompt_cache_enabled = enabled
+        server.prompt_cache.clear()
+        for name, call in calls:
+            with track_usage() as meter:
+                start = time.perf_counter()
+                for _ in range(args.requests):
+                    call()
+                elapsed = (time.perf_counter() - start) / args.requests
+            usage = meter.snapshot()
+            print(
+                f"{name:<22}{'on' if enabled else 'off':>14}"
+                f"{usage['input_tokens']:>13}{usage['cache_read_input_tokens']:>12}"
+                f"{usage['cache_creation_input_tokens']:>13}{elapsed * 1000:>11.1f}ms"
+            )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
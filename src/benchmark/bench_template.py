@@ -0,0 +1,62 @@
+"""
+Compare per-key str.replace substitution with a compiled Template rendering
+large prompts for many rows. Runs locally, no model calls.
+
+    cd src
+    python -m benchmark.bench_template --prompt-chars 20000 --variables 20 --rows 5000
+"""
+
+import argparse
+import time
+
+from template import Template
+
+
+def replace_loop(prompt, rows):
+    results = []
+    for row in rows:
+        rendered = prompt
+        for k, v in row.items():
+            rendered = rendered.replace(k, v)
+        results.append(rendered)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prompt-chars", type=int, default=20000)
+    parser.add_argument("--variables", type=int, default=20)
+    parser.add_argument("--rows", type=int, default=5000)
+    args = parser.parse_args()
+
+    filler = "Follow the instructions carefully and answer in the requested format. "
+    chunk = len(filler) * max(1, args.prompt_chars // (len(filler) * args.variables))
+    prompt = "".join(
+        (filler * (chunk // len(filler) + 1))[:chunk] + f"{{{{var_{idx}}}}}\n"
+        for idx in range(args.variables)
+    )
+    rows = [
+        {f"{{{{var_{idx}}}}}": f"value {row}-{idx}" for idx in range(args.variables)}
+        for row in range(args.rows)
+    ]
+
+    start = time.perf_counter()
+    expected = replace_loop(prompt, rows)
+    replace_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    template = Template(prompt)
+    rendered = template.render_many(rows)
+    template_seconds = time.perf_counter() - start
+
+    assert rendered == expected
+    print(
+        f"{len(prompt)} chars x {args.variables} variables x {args.rows} rows\n"
+        f"str.replace loop  {replace_seconds:8.3f}s\n"
+        f"Template          {template_seconds:8.3f}s"
+        f"  ({replace_seconds / template_seconds:.1f}x)"
+    )
+
+
+if __name__ == "__main__":
+    main()
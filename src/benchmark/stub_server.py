@@ -0,0 +1,115 @@
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubBedrockHandler(BaseHTTPRequestHandler):
+    """
+    Minimal bedrock-runtime InvokeModel endpoint returning a canned Claude
+    Messages API response. `handshake_delay` is paid once per new connection to
+    emulate TCP/TLS setup, `response_delay` once per request and
+    `input_token_delay` per uncached input token to emulate model latency.
+    """
+
+    protocol_version = "HTTP/1.1"
+    handshake_delay = 0.0
+    response_delay = 0.0
+    # Per uncached input token, emulates prompt processing time
+    input_token_delay = 0.0
+    response_text = "stub response"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+        time.sleep(self.handshake_delay)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request_body = self.rfile.read(length)
+        match = re.match(r"/model/([^/]+)/invoke", self.path)
+        model_id = match.group(1) if match else ""
+        if model_id == "warm-up":
+            self.send_json(
+                400, {"message": "The provided model identifier is invalid."}
+            )
+            return
+        try:
+            request = json.loads(request_body)
+        except ValueError:
+            request = {}
+        self.server.requests.append(request)
+        usage = self.usage(request)
+        time.sleep(
+            self.response_delay
+            + self.input_token_delay
+            * (usage["input_tokens"] + usage["cache_creation_input_tokens"])
+        )
+        self.send_json(
+            200,
+            {
+                "id": "msg_stub",
+                "type": "message",
+                "role": "assistant",
+                "content": [{"type": "text", "text": self.response_text}],
+                "stop_reason": "end_turn",
+                "usage": usage,
+            },
+        )
+
+    def usage(self, request):
+        """
+        Echo usage fields the way the provider reports them: text up to the
+        last cache_control breakpoint is written to the prompt cache on first
+        sight and read from it afterwards, roughly 4 characters per token.
+        """
+        cached_text, uncached_text = "", ""
+        for message in request.get("messages", []):
+            content = message["content"]
+            if isinstance(content, str):
+                content = [{"type": "text", "text": content}]
+            for block in content:
+                uncached_text += block.get("text", "")
+                if "cache_control" in block:
+                    cached_text += uncached_text
+                    uncached_text = ""
+        usage = {
+            "input_tokens": len(uncached_text) // 4,
+            "output_tokens": len(self.response_text) // 4,
+            "cache_read_input_tokens": 0,
+            "cache_creation_input_tokens": 0,
+        }
+        if cached_text:
+            with self.server.lock:
+                if cached_text in self.server.prompt_cache:
+                    usage["cache_read_input_tokens"] = len(cached_text) // 4
+                else:
+                    self.server.prompt_cache.add(cached_text)
+                    usage["cache_creation_input_tokens"] = len(cached_text) // 4
+        return usage
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if status != 200:
+            self.send_header("x-amzn-ErrorType", "ValidationException")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(handler=StubBedrockHandler):
+    """Start a stub endpoint on a free local port, returns (server, endpoint_url)."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    server.connections = 0
+    server.requests = []
+    server.prompt_cache = set()
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
@@ -0,0 +1,138 @@
+import contextvars
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+default_max_workers = int(os.getenv("MAX_CONCURRENT_REQUESTS", "4"))
+
+
+class RateLimiter:
+    """
+    Space out calls to at most `per_minute` starts per minute across threads;
+    call wait() before each request. 0 or None disables the limit.
+    """
+
+    def __init__(self, per_minute=None):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self.lock = threading.Lock()
+        self.next_start = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def bounded_map(func, items, max_workers=None):
+    """
+    Apply `func` to every item on a bounded thread pool and return the results
+    in input order. `max_workers=1` runs sequentially on the calling thread.
+    """
+    items = list(items)
+    if max_workers is None:
+        max_workers = default_max_workers
+    if max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        # Copy the caller's context so context variables (e.g. usage tracking)
+        # are visible inside the worker threads.
+        futures = [
+            executor.submit(contextvars.copy_context().run, func, item)
+            for item in items
+        ]
+        return [future.result() for future in futures]
+
+
+def bounded_as_completed(func, items, max_workers=None):
+    """
+    Like `bounded_map` but yield `(index, result)` pairs as soon as each call
+    finishes, so callers can surface partial results early.
+    """
+    items = list(items)
+    if max_workers is None:
+        max_workers = default_max_workers
+    if max_workers <= 1 or len(items) <= 1:
+        for idx, item in enumerate(items):
+            yield idx, func(item)
+        return
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        futures = {
+            executor.submit(contextvars.copy_context().run, func, item): idx
+            for idx, item in enumerate(items)
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def merge_streams(streams, timeouts=None):
+    """
+    Consume several generators concurrently, one thread each, and yield
+    `(index, item)` pairs in arrival order.
+
+    A stream that raises yields `(index, exception)` once and ends. A stream
+    still running `timeouts[index]` seconds after the start yields
+    `(index, TimeoutError)` and is abandoned (its generator is closed at its
+    next item), so a slow stream cannot hold up the others.
+    """
+    streams = list(streams)
+    timeouts = list(timeouts or [None] * len(streams))
+    events = queue.Queue()
+    stops = [threading.Event() for _ in streams]
+
+    def consume(idx, stream):
+        try:
+            for item in stream:
+                if stops[idx].is_set():
+                    break
+                events.put((idx, "item", item))
+        except Exception as e:
+            events.put((idx, "error", e))
+        finally:
+            if hasattr(stream, "close"):
+                stream.close()
+            events.put((idx, "done", None))
+
+    start = time.monotonic()
+    for idx, stream in enumerate(streams):
+        threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(consume, idx, stream),
+            daemon=True,
+        ).start()
+    pending = set(range(len(streams)))
+    try:
+        while pending:
+            deadlines = [
+                start + timeouts[idx] for idx in pending if timeouts[idx] is not None
+            ]
+            wait = max(0, min(deadlines) - time.monotonic()) if deadlines else None
+            try:
+                idx, kind, value = events.get(timeout=wait)
+            except queue.Empty:
+                now = time.monotonic()
+                for idx in sorted(pending):
+                    if timeouts[idx] is not None and start + timeouts[idx] <= now:
+                        stops[idx].set()
+                        pending.discard(idx)
+                        yield idx, TimeoutError(
+                            f"no complete response within {timeouts[idx]}s"
+                        )
+                continue
+            if idx not in pending:
+                continue
+            if kind == "item":
+                yield idx, value
+            else:
+                pending.discard(idx)
+                if kind == "error":
+                    yield idx, value
+    finally:
+        for stop in stops:
+            stop.set()
@@ -0,0 +1,268 @@
+import csv
+import hashlib
+import json
+import math
+import os
+import threading
+
+from concurrency import bounded_map
+from template import render_prompt
+
+
+def iter_dataset(path):
+    """
+    Yield variable assignments, one dict per row, from a .jsonl or .csv file
+    without loading the whole file.
+
+    Column names may be given bare (`document`) or as the placeholder used in
+    the prompt (`{{document}}`); bare names are wrapped in `{{ }}`.
+    """
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        rows = (
+            csv.DictReader(f)
+            if path.endswith(".csv")
+            else (json.loads(line) for line in f if line.strip())
+        )
+        for row in rows:
+            yield {
+                (key if key.startswith("{") else "{{" + key + "}}"): str(value)
+                for key, value in row.items()
+            }
+
+
+def load_dataset(path):
+    return list(iter_dataset(path))
+
+
+def wilson_interval(wins, n, z=1.96):
+    """95% Wilson score interval for a win rate of `wins` out of `n`."""
+    if n == 0:
+        return (0.0, 1.0)
+    p = wins / n
+    denominator = 1 + z**2 / n
+    center = (p + z**2 / (2 * n)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / n + z**2 / (4 * n**2)) / denominator
+    return (max(0.0, center - margin), min(1.0, center + margin))
+
+
+def prompt_key(prompt):
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+def row_keys(rows):
+    """
+    Identify each row by a hash of its content, numbered among identical
+    rows, so checkpoint records follow the data rather than its position.
+    """
+    seen = {}
+    keys = []
+    for row in rows:
+        digest = prompt_key(json.dumps(row, sort_keys=True, ensure_ascii=False))
+        seen[digest] = seen.get(digest, 0) + 1
+        keys.append(f"{digest}-{seen[digest]}")
+    return keys
+
+
+class Checkpoint:
+    """
+    Append-only JSONL log of finished outputs and verdicts, keyed by prompt
+    and row content, plus the candidate prompts generated for an evaluation.
+    Records are written as soon as each model call returns, so an interrupted
+    evaluation resumes from where it stopped, and rows that were edited since
+    are evaluated again.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.outputs = {}
+        self.verdicts = {}
+        self.candidates = {}
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A line cut short by the crash
+                        continue
+                    if record["kind"] == "candidates":
+                        self.candidates[record["prompt"]] = record["candidates"]
+                        continue
+                    key = (record["prompt"], record["row"])
+                    if record["kind"] == "output":
+                        self.outputs[key] = record["output"]
+                    else:
+                        self.verdicts[key] = record["verdict"]
+
+    def put(self, kind, prompt, row, value):
+        key = (prompt, row)
+        with self.lock:
+            if kind == "output":
+                self.outputs[key] = value
+            else:
+                self.verdicts[key] = value
+            self.write({"kind": kind, "prompt": prompt, "row": row, kind: value})
+
+    def put_candidates(self, prompt, candidates):
+        """Record the candidate prompts generated for `prompt` (a key)."""
+        with self.lock:
+            self.candidates[prompt] = list(candidates)
+            self.write(
+                {"kind": "candidates", "prompt": prompt, "candidates": list(candidates)}
+            )
+
+    def write(self, record):
+        if self.path:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+class DatasetEvaluator:
+    """
+    Score candidate prompts over a dataset of variable assignments.
+
+    Every candidate and the baseline prompt are run on every row, then each
+    candidate's output is judged against the baseline's output for the same
+    row with Rater.compare (in both orders when the rater's both_orders is
+    set, a split verdict is a draw). Draws count as half a win.
+    """
+
+    def __init__(self, rater, max_workers=None, checkpoint_path=None):
+        self.rater = rater
+        self.max_workers = max_workers
+        self.checkpoint = Checkpoint(checkpoint_path)
+
+    def __call__(self, baseline, candidates, rows):
+        """
+        Return one result dict per candidate prompt, best win rate first,
+        with `wins`, `losses`, `draws`, `rows`, `win_rate` and its Wilson
+        `ci` against `baseline`.
+        """
+        if not candidates:
+            return []
+        if isinstance(rows, str):
+            rows = load_dataset(rows)
+        keys = row_keys(rows)
+        self.evaluate_rows(baseline, candidates, rows, range(len(rows)), keys)
+        results = [self.summarize(candidate, keys) for candidate in candidates]
+        return sorted(results, key=lambda result: -result["win_rate"])
+
+    def race(self, baseline, candidates, rows, initial_rows=8, growth=2):
+        """
+        Evaluate on growing prefixes of `rows` (`initial_rows`, then
+        `growth` times more each round) and drop a candidate as soon as its
+        Wilson interval lies entirely below the leader's, so losing candidates
+        stop costing get_output and judge calls early. Shuffle the dataset
+        beforehand if its order is not random.
+
+        Returns a dict with the per-candidate `results` (survivors first, each
+        with the number of `rows` it was scored on and the `eliminated`
+        flag), the `calls` made for it and the `calls_saved` compared with a
+        full evaluation of every candidate.
+        """
+        if not candidates:
+            return {"results": [], "calls": 0, "calls_saved": 0}
+        if isinstance(rows, str):
+            rows = load_dataset(rows)
+        keys = row_keys(rows)
+        active = list(dict.fromkeys(candidates))
+        eliminated = []
+        size = min(initial_rows, len(rows))
+        while True:
+            self.evaluate_rows(baseline, active, rows, range(size), keys)
+            results = [self.summarize(candidate, keys[:size]) for candidate in active]
+            leader = max(results, key=lambda result: result["win_rate"])
+            for result in results:
+                if result["ci"][1] < leader["ci"][0]:
+                    active.remove(result["prompt"])
+                    eliminated.append(dict(result, eliminated=True))
+            if size == len(rows) or len(active) == 1:
+                break
+            size = min(size * growth, len(rows))
+        survivors = [
+            dict(self.summarize(candidate, keys[:size]), eliminated=False)
+            for candidate in active
+        ]
+        judge_calls_per_verdict = 2 if self.rater.both_orders else 1
+        # The baseline runs on every row that any candidate reached
+        calls = size + sum(
+            result["rows"] * (1 + judge_calls_per_verdict)
+            for result in survivors + eliminated
+        )
+        full_calls = len(rows) + len(survivors + eliminated) * len(rows) * (
+            1 + judge_calls_per_verdict
+        )
+        return {
+            "results": sorted(survivors, key=lambda result: -result["win_rate"])
+            + sorted(eliminated, key=lambda result: -result["win_rate"]),
+            "calls": calls,
+            "calls_saved": full_calls - calls,
+        }
+
+    def evaluate_rows(self, baseline, candidates, rows, row_indices, keys=None):
+        """
+        Fill in the outputs and verdicts missing for `row_indices`; `keys` are
+        the row_keys of `rows`, computed when not given.
+        """
+        keys = keys or row_keys(rows)
+        prompts = {prompt_key(prompt): prompt for prompt in [baseline] + candidates}
+        baseline_key = prompt_key(baseline)
+
+        def run_output(task):
+            key, row = task
+            output = self.rater.get_output(render_prompt(prompts[key], rows[row]))
+            self.checkpoint.put("output", key, keys[row], output)
+
+        bounded_map(
+            run_output,
+            [
+                (key, row)
+                for key in prompts
+                for row in row_indices
+                if (key, keys[row]) not in self.checkpoint.outputs
+            ],
+            max_workers=self.max_workers,
+        )
+
+        def run_verdict(task):
+            key, row = task
+            instruction = render_prompt(baseline, rows[row])
+            candidate_output = self.checkpoint.outputs[(key, keys[row])]
+            baseline_output = self.checkpoint.outputs[(baseline_key, keys[row])]
+            outcome = self.rater.compare(instruction, candidate_output, baseline_output)
+            verdict = {0: "win", 1: "loss"}.get(outcome, "draw")
+            if self.rater.both_orders:
+                swapped = self.rater.compare(
+                    instruction, baseline_output, candidate_output
+                )
+                if {0: "loss", 1: "win"}.get(swapped, "draw") != verdict:
+                    verdict = "draw"
+            self.checkpoint.put("verdict", key, keys[row], verdict)
+
+        bounded_map(
+            run_verdict,
+            [
+                (key, row)
+                for key in dict.fromkeys(
+                    prompt_key(candidate) for candidate in candidates
+                )
+                for row in row_indices
+                if (key, keys[row]) not in self.checkpoint.verdicts
+            ],
+            max_workers=self.max_workers,
+        )
+
+    def summarize(self, candidate, keys):
+        key = prompt_key(candidate)
+        verdicts = [self.checkpoint.verdicts[(key, row)] for row in keys]
+        wins = verdicts.count("win") + 0.5 * verdicts.count("draw")
+        return {
+            "prompt": candidate,
+            "wins": verdicts.count("win"),
+            "losses": verdicts.count("loss"),
+            "draws": verdicts.count("draw"),
+            "rows": len(verdicts),
+            "win_rate": wins / len(verdicts) if verdicts else 0.0,
+            "ci": wilson_interval(wins, len(verdicts)),
+        }
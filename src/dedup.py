@@ -0,0 +1,80 @@
+import hashlib
+import random
+import re
+
+# Mersenne prime for the MinHash permutations
+_prime = (1 << 61) - 1
+
+
+def normalize(text):
+    """Lowercase and collapse whitespace, so layout-only changes hash equal."""
+    return " ".join(text.lower().split())
+
+
+def shingles(text, size=5):
+    text = re.sub(r"[^\w{}$ ]", "", normalize(text))
+    if len(text) <= size:
+        return {text}
+    return {text[idx : idx + size] for idx in range(len(text) - size + 1)}
+
+
+class MinHasher:
+    """MinHash signatures of character shingles; matching slots estimate Jaccard."""
+
+    def __init__(self, num_perm=64, shingle_size=5, seed=1):
+        rng = random.Random(seed)
+        self.shingle_size = shingle_size
+        self.permutations = [
+            (rng.randrange(1, _prime), rng.randrange(0, _prime))
+            for _ in range(num_perm)
+        ]
+
+    def signature(self, text):
+        values = [
+            int.from_bytes(
+                hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big"
+            )
+            for shingle in shingles(text, self.shingle_size)
+        ]
+        return [
+            min((a * value + b) % _prime for value in values)
+            for a, b in self.permutations
+        ]
+
+    @staticmethod
+    def similarity(first, second):
+        return sum(x == y for x, y in zip(first, second)) / len(first)
+
+
+def cluster(texts, threshold=0.85, hasher=None):
+    """
+    Group near-identical texts. Returns, for each text, the index of its
+    cluster's representative (the first member), so `representatives` are the
+    indices where `assignment[idx] == idx`.
+
+    Texts equal after normalize() are grouped by hash; the rest are grouped
+    when their estimated shingle Jaccard similarity reaches `threshold`.
+    """
+    hasher = hasher or MinHasher()
+    assignment = []
+    exact = {}
+    signatures = {}
+    for idx, text in enumerate(texts):
+        digest = hashlib.sha256(normalize(text).encode("utf-8")).hexdigest()
+        if digest in exact:
+            assignment.append(exact[digest])
+            continue
+        signature = hasher.signature(text)
+        representative = next(
+            (
+                rep
+                for rep, rep_signature in signatures.items()
+                if hasher.similarity(signature, rep_signature) >= threshold
+            ),
+            idx,
+        )
+        exact[digest] = representative
+        if representative == idx:
+            signatures[idx] = signature
+        assignment.append(representative)
+    return assignment
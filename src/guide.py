@@ -0,0 +1,141 @@
+import os
+import re
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Get the directory where the current script is located
+current_script_path = os.path.dirname(os.path.abspath(__file__))
+
+# Construct the full path to the file
+prompt_guide_path = os.path.join(current_script_path, "PromptGuide.md")
+prompt_guide_short_path = os.path.join(
+    current_script_path, "prompt", "prompt_guide_short.prompt"
+)
+
+# Open the file using the full path
+with open(prompt_guide_path, "r") as f:
+    PromptGuide = f.read()
+
+with open(prompt_guide_short_path, "r") as f:
+    PromptGuideShort = f.read()
+# Drop the "Here is a simplified version..." preamble left by its generation
+if PromptGuideShort.startswith("Here is"):
+    PromptGuideShort = PromptGuideShort.split("\n", 1)[1].lstrip()
+
+guides = {
+    "full": PromptGuide,
+    "short": PromptGuideShort,
+}
+# "relevant" sends only the guide sections that match the prompt
+guide_variants = ["full", "short", "relevant", "auto"]
+
+# Default variant when a call does not choose one
+default_guide_variant = os.getenv("GUIDE_VARIANT", "full")
+# In auto mode, prompts shorter than this (in characters) get the short guide
+guide_auto_threshold = int(os.getenv("GUIDE_AUTO_THRESHOLD", "1500"))
+# Section retrieval limits for the relevant variant
+guide_top_k = int(os.getenv("GUIDE_TOP_K", "6"))
+guide_token_budget = int(os.getenv("GUIDE_TOKEN_BUDGET", "3000"))
+
+_guide_index = None
+_guide_index_lock = threading.Lock()
+
+
+def resolve_guide_variant(guide_variant, initial_prompt):
+    """
+    Resolve a guide variant setting ("full", "short", "relevant" or "auto",
+    None for the default) to the concrete guide to send for `initial_prompt`.
+    """
+    guide_variant = guide_variant or default_guide_variant
+    if guide_variant == "auto":
+        if len(initial_prompt) < guide_auto_threshold:
+            return "short"
+        return "full"
+    if guide_variant not in guides and guide_variant != "relevant":
+        raise ValueError(
+            f"Unknown guide variant {guide_variant!r}, expected one of {guide_variants}"
+        )
+    return guide_variant
+
+
+def split_sections(markdown):
+    """
+    Split the guide into `#`/`##`/`###` sections. Each section is a dict with
+    its `text` and the `parent` top-level heading it belongs to; `####`
+    headings stay inside their section.
+    """
+    sections = []
+    parent = ""
+    current = []
+
+    def flush():
+        text = "\n".join(current).strip()
+        # Skip headings without a body, e.g. the document title
+        if text and "\n" in text:
+            sections.append({"parent": parent, "text": text})
+
+    for line in markdown.splitlines():
+        match = re.match(r"(#{1,3}) ", line)
+        if match:
+            flush()
+            current = []
+            if len(match.group(1)) <= 2:
+                parent = line
+        current.append(line)
+    flush()
+    return sections
+
+
+guide_sections = split_sections(PromptGuide)
+
+
+def get_guide_index():
+    """Return the section index over PromptGuide.md, built once per process."""
+    global _guide_index
+    # Imported lazily so the other variants do not need scikit-learn loaded
+    from retrieval import LexicalIndex
+
+    with _guide_index_lock:
+        if _guide_index is None:
+            _guide_index = LexicalIndex(
+                [
+                    section["parent"] + "\n" + section["text"]
+                    for section in guide_sections
+                ],
+                name="guide_index",
+            )
+    return _guide_index
+
+
+def relevant_guide(initial_prompt, top_k=None, token_budget=None):
+    """
+    Assemble a guide from the sections most relevant to `initial_prompt`,
+    at most `top_k` sections within `token_budget` tokens, in guide order.
+    """
+    selected = get_guide_index().select(
+        initial_prompt,
+        top_k=top_k or guide_top_k,
+        token_budget=token_budget or guide_token_budget,
+    )
+    parts = [PromptGuide.splitlines()[0]]
+    parent = None
+    for idx in selected:
+        section = guide_sections[idx]
+        if section["parent"] != parent and not section["text"].startswith(
+            section["parent"]
+        ):
+            parts.append(section["parent"])
+        parent = section["parent"]
+        parts.append(section["text"])
+    return "\n\n".join(parts)
+
+
+def select_guide(guide_variant, initial_prompt):
+    """Return the guide text to send for `initial_prompt`."""
+    guide_variant = resolve_guide_variant(guide_variant, initial_prompt)
+    if guide_variant == "relevant":
+        return relevant_guide(initial_prompt)
+    return guides[guide_variant]
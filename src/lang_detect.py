@@ -0,0 +1,73 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+# Han ideographs, CJK punctuation and full-width forms
+cjk_pattern = re.compile(r"[　-〿㐀-䶿一-鿿豈-﫿＀-￯]")
+latin_word_pattern = re.compile(r"[A-Za-z]+")
+# Template variables and xml tag names are English even in Chinese prompts
+ignore_pattern = re.compile(
+    r"\{\{.*?\}\}|\{\$?[A-Za-z_][\w]*\}|</?[\w\s-]+>", re.DOTALL
+)
+
+# Frequent English function words, a unigram model good enough to tell English
+# apart from other Latin-script languages.
+english_words = set(
+    """
+    a about after all also an and any are as at be because been but by can could
+    do does each for from has have how i if in into is it its may more most must
+    no not of on one only or other our out should so some such than that the their
+    them then there these they this those to up use was we were what when where
+    which while who will with would you your
+    """.split()
+)
+
+lang_cache_size = 4096
+_lang_cache = OrderedDict()
+_lang_cache_lock = threading.Lock()
+
+
+def detect_lang_local(text):
+    """
+    Classify `text` as Chinese ("ch") or English ("en") from its character mix.
+
+    Returns `(lang, confidence)` where confidence is in [0, 1]; `lang` is ""
+    when there is nothing to go on. Latin text that does not look like English
+    is reported with low confidence so the caller can fall back to the model.
+    """
+    text = ignore_pattern.sub(" ", text)
+    cjk_count = len(cjk_pattern.findall(text))
+    latin_words = latin_word_pattern.findall(text)
+    latin_count = sum(len(word) for word in latin_words)
+    # One Han character carries roughly as much text as a short English word
+    total = cjk_count * 2 + latin_count
+    if total == 0:
+        return "", 0.0
+    cjk_ratio = cjk_count * 2 / total
+    if cjk_ratio >= 0.5:
+        return "ch", min(1.0, cjk_ratio)
+    latin_ratio = 1 - cjk_ratio
+    english_ratio = sum(word.lower() in english_words for word in latin_words) / len(
+        latin_words
+    )
+    # English prose runs at roughly 40-50% function words
+    return "en", latin_ratio * min(1.0, english_ratio / 0.2)
+
+
+def cached_lang(text, detect):
+    """
+    Memoize `detect(text)` by prompt hash in a bounded LRU so repeated rewrites
+    of the same prompt never detect twice.
+    """
+    key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    with _lang_cache_lock:
+        if key in _lang_cache:
+            _lang_cache.move_to_end(key)
+            return _lang_cache[key]
+    lang = detect(text)
+    with _lang_cache_lock:
+        _lang_cache[key] = lang
+        if len(_lang_cache) > lang_cache_size:
+            _lang_cache.popitem(last=False)
+    return lang
@@ -1,16 +1,23 @@
-import json
 import os
 import re
 
-import boto3
-from botocore.config import Config
 from dotenv import load_dotenv
 
+from bedrock import cacheable_prefix_content, get_bedrock_client, invoke_model_stream
+from tag_stream import TagStreamParser
+
 load_dotenv()
 
+# Worked examples sent with each task, chosen by similarity to the task.
+# A top-k of 0 sends the whole metaprompt with every example.
+example_top_k = int(os.getenv("METAPROMPT_EXAMPLE_TOP_K", "2"))
+example_token_budget = int(os.getenv("METAPROMPT_EXAMPLE_TOKEN_BUDGET", "4000"))
+
 
 class MetaPrompt:
-    def __init__(self):
+    def __init__(
+        self, example_top_k=example_top_k, example_token_budget=example_token_budget
+    ):
         # Get the directory where the current script is located
         current_script_path = os.path.dirname(os.path.abspath(__file__))
 
@@ -21,68 +28,99 @@ class MetaPrompt:
         with open(prompt_guide_path, "r") as f:
             self.metaprompt = f.read()
 
-        region_name = os.getenv("REGION_NAME")
-        session = boto3.Session()
-        retry_config = Config(
-            region_name=region_name,
-            retries={
-                "max_attempts": 5,
-                "mode": "standard",
-            },
-        )
-        service_name = "bedrock-runtime"
-        self.bedrock_client = session.client(
-            service_name=service_name, config=retry_config
+        # Split into the fixed header, the library of worked examples and the
+        # footer holding {{TASK}}
+        examples = list(
+            re.finditer(
+                r"<Task Instruction Example>.*?</Task Instruction Example>",
+                self.metaprompt,
+                re.DOTALL,
+            )
         )
+        self.header = self.metaprompt[: examples[0].start()]
+        self.examples = [example.group(0) for example in examples]
+        self.footer = self.metaprompt[examples[-1].end() :]
+        self.example_top_k = example_top_k
+        self.example_token_budget = example_token_budget
+        self._example_index = None
+
+        self.bedrock_client = get_bedrock_client()
+        self.model_id = "anthropic.claude-3-haiku-20240307-v1:0"  # anthropic.claude-3-sonnet-20240229-v1:0 "anthropic.claude-3-haiku-20240307-v1:0"
 
     def __call__(self, task, variables):
+        # Consume the stream so generation stops right after </Instructions>
+        for result in self.stream(task, variables):
+            pass
+        return result
+
+    def stream(self, task, variables):
+        """
+        Streaming variant of __call__ for Gradio handlers: yields
+        `(instructions_so_far, "")` as the <Instructions> section arrives, then
+        the same `(prompt_template, variables)` pair __call__ returns.
+
+        The model stream is closed as soon as </Instructions> is generated,
+        trailing tokens are never waited for.
+        """
+        body = self.build_body(task, variables)
+        parser = TagStreamParser("Instructions")
+        deltas = invoke_model_stream(
+            self.bedrock_client, body, self.model_id, stop_at="</Instructions>"
+        )
+        for _ in parser.consume(deltas):
+            yield parser.content, ""
+        yield self.post_process(parser.text)
+
+    def build_body(self, task, variables):
         variables = variables.split("\n")
         variables = [variable for variable in variables if len(variable)]
 
         variable_string = ""
         for variable in variables:
             variable_string += "\n{$" + variable.upper() + "}"
-        prompt = self.metaprompt.replace("{{TASK}}", task)
+        # Only text shared by every task goes in the cacheable prefix: all of
+        # the metaprompt before {{TASK}} when it is sent whole, just the header
+        # when examples are selected per task, since they change with the task
+        before_task, after_task = self.build_metaprompt(task).split("{{TASK}}", 1)
+        prefix = self.header if self.example_top_k else before_task
+        suffix = before_task[len(prefix) :] + task + after_task
         assistant_partial = "<Inputs>"
         if variable_string:
             assistant_partial += (
                 variable_string + "\n</Inputs>\n<Instructions Structure>"
             )
         messages = [
-            {"role": "user", "content": prompt},
+            {"role": "user", "content": cacheable_prefix_content(prefix, suffix)},
             {"role": "assistant", "content": assistant_partial},
         ]
-        body = json.dumps(
-            {
-                "messages": messages,
-                "max_tokens": 4096,
-                "temperature": 0.0,
-                "anthropic_version": "bedrock-2023-05-31",
-            }
-        )
-        modelId = "anthropic.claude-3-haiku-20240307-v1:0"  # anthropic.claude-3-sonnet-20240229-v1:0 "anthropic.claude-3-haiku-20240307-v1:0"
-        accept = "application/json"
-        contentType = "application/json"
-
-        response = self.bedrock_client.invoke_model(
-            body=body, modelId=modelId, accept=accept, contentType=contentType
-        )
-        response_body = json.loads(response.get("body").read())
-        message = response_body["content"][0]["text"]
-
-        def pretty_print(message):
-            print(
-                "\n\n".join(
-                    "\n".join(
-                        line.strip()
-                        for line in re.findall(
-                            r".{1,100}(?:\s+|$)", paragraph.strip("\n")
-                        )
-                    )
-                    for paragraph in re.split(r"\n\n+", message)
-                )
+        body = {
+            "messages": messages,
+            "max_tokens": 4096,
+            "temperature": 0.0,
+            "anthropic_version": "bedrock-2023-05-31",
+        }
+        return body
+
+    def build_metaprompt(self, task):
+        """
+        Assemble the metaprompt from the header, the examples most similar to
+        `task` within the example budget, and the footer.
+        """
+        if not self.example_top_k:
+            return self.metaprompt
+        if self._example_index is None:
+            from retrieval import LexicalIndex
+
+            self._example_index = LexicalIndex(
+                self.examples, name="metaprompt_examples"
             )
+        selected = self._example_index.select(
+            task, top_k=self.example_top_k, token_budget=self.example_token_budget
+        )
+        examples = [self.examples[idx] for idx in selected]
+        return self.header + "\n".join(examples) + self.footer
 
+    def post_process(self, message):
         extracted_prompt_template = self.extract_prompt(message)
         variables = self.extract_variables(message)
 
@@ -1,12 +1,21 @@
+import contextvars
 import json
 import os
 import re
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-import boto3
-from botocore.config import Config
 from openai import OpenAI
 from dotenv import load_dotenv
 
+from bedrock import get_bedrock_client, invoke_model, invoke_model_stream
+from concurrency import RateLimiter, merge_streams
+from dataset import iter_dataset
+from similarity import compare_outputs, format_signals
+from tag_stream import TagStreamParser
+from template import render_prompt
+
 load_dotenv()
 
 default_system = "You are a helpful and knowledgeable assistant who is able to provide detailed and accurate information on a wide range of topics. You are also able to provide clear and concise answers to questions and are always willing to go the extra mile to help others."
@@ -26,6 +35,11 @@ Here are the Claude response:
 {_Bedrock}
 </response>
 
+Here are the signals from an automatic local comparison of the two responses:
+<local_signals>
+{_signals}
+</local_signals>
+
 Please follow these steps:
 1. Carefully analyze both responses in terms of content accuracy, logical organization, and expression style.
 2. Summarize the differences between the Claude response and the OpenAI response.
@@ -68,12 +82,25 @@ Finally, provide the revised prompt within the following XML tags:
 
 openai_api_key = os.getenv("OPENAI_API_KEY")
 openai_base_url = os.getenv("OPENAI_BASE_URL")
+# Per-side limits, in seconds, for the Prompt Evaluation responses
+openai_timeout = float(os.getenv("ALIGNMENT_OPENAI_TIMEOUT", "120"))
+bedrock_timeout = float(os.getenv("ALIGNMENT_BEDROCK_TIMEOUT", "120"))
+# Separate pools for batch evaluation, so each provider gets its own
+# concurrency and requests-per-minute limit (0 means no limit)
+openai_concurrency = int(os.getenv("ALIGNMENT_OPENAI_CONCURRENCY", "4"))
+bedrock_concurrency = int(os.getenv("ALIGNMENT_BEDROCK_CONCURRENCY", "4"))
+openai_rpm = int(os.getenv("ALIGNMENT_OPENAI_RPM", "0"))
+bedrock_rpm = int(os.getenv("ALIGNMENT_BEDROCK_RPM", "0"))
+# Local similarity (see similarity.compare_outputs) at which the Claude response
+# counts as aligned: evaluate_response skips the model call and auto_align stops
+alignment_similarity_threshold = float(
+    os.getenv("ALIGNMENT_SIMILARITY_THRESHOLD", "0.9")
+)
+results_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
 
 class Alignment:
     def __init__(self):
-        self.bedrock_client = boto3.client(
-            service_name="bedrock-runtime", region_name=os.getenv("REGION_NAME")
-        )
+        self.bedrock_client = get_bedrock_client()
         try:
             self.openai_client = OpenAI(
                 base_url=openai_base_url,
@@ -84,16 +111,25 @@ class Alignment:
         except:
             self.openai_client = None
 
-    def generate_bedrock_response(self, prompt, model_id):
+    def generate_bedrock_response(self, prompt, model_id, use_cache=None):
         """
         This function generates a test dataset by invoking a model with a given prompt.
 
         Parameters:
         prompt (str): The user input prompt.
+        use_cache (bool): Serve repeated requests from the response cache, see
+            bedrock.invoke_model.
 
         Returns:
         matches (list): A list of questions generated by the model, each wrapped in <case></case> XML tags.
         """
+        body = self.build_bedrock_body(prompt)
+        response_body = invoke_model(
+            self.bedrock_client, body, model_id, use_cache=use_cache
+        )
+        return response_body["content"][0]["text"]
+
+    def build_bedrock_body(self, prompt):
         message = {
             "role": "user",
             "content": [
@@ -102,17 +138,13 @@ class Alignment:
             ],
         }
         messages = [message]
-        body = json.dumps(
-            {
-                "anthropic_version": "bedrock-2023-05-31",
-                "max_tokens": 4000,
-                "messages": messages,
-                "system": bedrock_default_system,
-            }
-        )
-        response = self.bedrock_client.invoke_model(body=body, modelId=model_id)
-        response_body = json.loads(response.get("body").read())
-        return response_body["content"][0]["text"]
+        body = {
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": 4000,
+            "messages": messages,
+            "system": bedrock_default_system,
+        }
+        return body
 
     def generate_openai_response(self, prompt, model_id):
         completion = self.openai_client.chat.completions.create(
@@ -124,38 +156,38 @@ class Alignment:
         )
         return completion.choices[0].message.content
 
-    def stream_bedrock_response(self, prompt, model_id, output_component):
-        message = {"role": "user", "content": [{"type": "text", "text": prompt}]}
-        messages = [message]
-        body = json.dumps(
-            {
-                "anthropic_version": "bedrock-2023-05-31",
-                "max_tokens": 4000,
-                "messages": messages,
-                "system": bedrock_default_system,
-            }
-        )
-        response = self.bedrock_client.invoke_model_with_response_stream(
-            modelId=model_id, body=body
-        )
-
-        stream = response.get("body")
-        if stream:
-            for event in stream:
-                chunk = event.get("chunk")
-                if chunk:
-                    output = json.loads(chunk.get("bytes").decode())
-                    output_component.update(output)
+    def stream_bedrock_response(self, prompt, model_id, use_cache=None, stop_at=None):
+        """
+        Streaming variant of generate_bedrock_response, yields the response
+        text accumulated so far as tokens arrive. Reading stops once `stop_at`
+        has been generated.
+        """
+        body = self.build_bedrock_body(prompt)
+        result = ""
+        for delta in invoke_model_stream(
+            self.bedrock_client, body, model_id, use_cache=use_cache, stop_at=stop_at
+        ):
+            result += delta
+            yield result
 
-    def stream_openai_response(self, prompt, model_id, output_component):
+    def stream_openai_response(self, prompt, model_id):
+        """
+        Streaming variant of generate_openai_response, yields the response
+        text accumulated so far as tokens arrive.
+        """
         stream = self.openai_client.chat.completions.create(
             model=model_id,
-            messages=[{"role": "user", "content": prompt}],
+            messages=[
+                {"role": "system", "content": openai_default_system},
+                {"role": "user", "content": prompt},
+            ],
             stream=True,
         )
+        result = ""
         for chunk in stream:
-            if chunk.choices[0].delta.content is not None:
-                output_component.update(chunk.choices[0].delta.content, append=True)
+            if chunk.choices and chunk.choices[0].delta.content is not None:
+                result += chunk.choices[0].delta.content
+                yield result
 
     def invoke_prompt(
         self,
@@ -170,23 +202,79 @@ class Alignment:
             original_prompt_replace = original_prompt
         if len(revised_prompt_replace) == 0:
             revised_prompt_replace = revised_prompt
+        for results, _ in self.stream_prompts(
+            original_prompt_replace,
+            revised_prompt_replace,
+            openai_model_id,
+            aws_model_id,
+        ):
+            yield results[0], results[1]
+
+    def stream_prompts(
+        self, openai_prompt, bedrock_prompt, openai_model_id, aws_model_id
+    ):
+        """
+        Run `openai_prompt` on OpenAI and `bedrock_prompt` on Bedrock, yielding
+        `(results, failed)` as either side streams: the text shown for each
+        side and whether it ended with an error (appended to its text).
+        """
         if self.openai_client is None:
-            openai_result = "OpenAIError: The api_key client option must be set either by passing api_key to the client or by setting the OPENAI_API_KEY environment variable"
-            aws_result = "OpenAIError: The api_key client option must be set either by passing api_key to the client or by setting the OPENAI_API_KEY environment variable"
-            return openai_result, aws_result
-        openai_result = self.generate_openai_response(
-            original_prompt_replace, openai_model_id
-        )
-        aws_result = self.generate_bedrock_response(
-            revised_prompt_replace, aws_model_id
-        )
-        return openai_result, aws_result
+            error = (
+                "OpenAIError: The api_key client option must be set either by "
+                "passing api_key to the client or by setting the OPENAI_API_KEY "
+                "environment variable"
+            )
+            yield [error, error], [True, True]
+            return
+        # The two providers are independent: stream both at once so the
+        # latency is the slower side rather than the sum, each with its own
+        # timeout so a slow provider does not hold back the other's result
+        results = ["", ""]
+        failed = [False, False]
+        for idx, value in merge_streams(
+            [
+                self.stream_openai_response(openai_prompt, openai_model_id),
+                self.stream_bedrock_response(bedrock_prompt, aws_model_id),
+            ],
+            timeouts=[openai_timeout, bedrock_timeout],
+        ):
+            if isinstance(value, Exception):
+                error = f"{type(value).__name__}: {value}"
+                results[idx] = f"{results[idx]}\n\n{error}" if results[idx] else error
+                failed[idx] = True
+            else:
+                results[idx] = value
+            yield results, failed
 
-    def evaluate_response(self, openai_output, aws_output, eval_model_id):
+    def evaluate_response(
+        self, openai_output, aws_output, eval_model_id, similarity_threshold=None
+    ):
+        if similarity_threshold is None:
+            similarity_threshold = alignment_similarity_threshold
+        # Near-identical responses with the same shape need no model call
+        comparison = compare_outputs(openai_output, aws_output)
+        if (
+            comparison["score"] >= similarity_threshold
+            and not comparison["differences"]
+        ):
+            return (
+                f"Aligned: local similarity {comparison['score']:.2f} "
+                f"(TF-IDF {comparison['tfidf']:.2f}, "
+                f"ROUGE-L {comparison['rouge_l']:.2f}) "
+                "with the same structure, no model evaluation needed."
+                "\n<recommendation></recommendation>"
+            )
         revised_prompt = evaluate_response_prompt_template.format(
-            _OpenAI=openai_output, _Bedrock=aws_output
+            _OpenAI=openai_output,
+            _Bedrock=aws_output,
+            _signals=format_signals(comparison),
         )
-        aws_result = self.generate_bedrock_response(revised_prompt, eval_model_id)
+        # Nothing after </recommendation> is used, stop reading there
+        aws_result = ""
+        for aws_result in self.stream_bedrock_response(
+            revised_prompt, eval_model_id, use_cache=True, stop_at="</recommendation>"
+        ):
+            pass
         pattern = r"<auto_feedback>(.*?)</auto_feedback>"
         feedback = re.findall(pattern, aws_result, re.DOTALL)[0]
 
@@ -197,14 +285,251 @@ class Alignment:
         # matches = matches[0]#.replace("\n", "").replace("[", "").replace("]", "")
         return feedback + f"\n<recommendation>{recommendation}</recommendation>"
 
+    def evaluate_dataset(
+        self,
+        original_prompt,
+        revised_prompt,
+        dataset,
+        openai_model_id,
+        aws_model_id,
+        eval_model_id,
+        results_path=None,
+        summary_top_k=10,
+    ):
+        """
+        Batch version of invoke_prompt + evaluate_response over a .jsonl/.csv
+        `dataset` of variable assignments.
+
+        Each row renders both prompts, runs the OpenAI and Bedrock sides on
+        their own rate-limited pools, then evaluates the pair. Rows are read
+        lazily and written to the JSONL `results_path` as they complete, so
+        only the rows in flight and the recommendation counts stay in memory.
+
+        Yields a progress dict after every row; the last one also carries the
+        `summary` of the most frequent recommendations and the
+        `revised_prompt` generated once from it.
+        """
+        if results_path is None:
+            os.makedirs(results_dir, exist_ok=True)
+            results_path = os.path.join(
+                results_dir, f"alignment_results_{int(time.time())}.jsonl"
+            )
+        openai_limiter = RateLimiter(openai_rpm)
+        bedrock_limiter = RateLimiter(bedrock_rpm)
+        openai_pool = ThreadPoolExecutor(max_workers=openai_concurrency)
+        bedrock_pool = ThreadPoolExecutor(max_workers=bedrock_concurrency)
+        in_flight_limit = 2 * (openai_concurrency + bedrock_concurrency)
+        # Row workers only wait on the provider pools
+        row_pool = ThreadPoolExecutor(max_workers=in_flight_limit)
+
+        def limited(limiter, func, *args):
+            limiter.wait()
+            return func(*args)
+
+        def submit(pool, limiter, func, *args):
+            return pool.submit(
+                contextvars.copy_context().run, limited, limiter, func, *args
+            )
+
+        def run_row(idx, row):
+            openai_future = submit(
+                openai_pool,
+                openai_limiter,
+                self.generate_openai_response,
+                render_prompt(original_prompt, row),
+                openai_model_id,
+            )
+            aws_future = submit(
+                bedrock_pool,
+                bedrock_limiter,
+                self.generate_bedrock_response,
+                render_prompt(revised_prompt, row),
+                aws_model_id,
+            )
+            result = {"row": idx, "variables": row}
+            try:
+                result["openai"] = openai_future.result()
+                result["bedrock"] = aws_future.result()
+                result["evaluation"] = submit(
+                    bedrock_pool,
+                    bedrock_limiter,
+                    self.evaluate_response,
+                    result["openai"],
+                    result["bedrock"],
+                    eval_model_id,
+                ).result()
+            except Exception as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+            return result
+
+        recommendations = Counter()
+        wording = {}
+        example = None
+        completed = errors = 0
+        pending = set()
+        try:
+            with open(results_path, "w", encoding="utf-8") as f:
+                rows = enumerate(iter_dataset(dataset))
+                exhausted = False
+                while pending or not exhausted:
+                    while not exhausted and len(pending) < in_flight_limit:
+                        try:
+                            idx, row = next(rows)
+                        except StopIteration:
+                            exhausted = True
+                            break
+                        pending.add(
+                            row_pool.submit(
+                                contextvars.copy_context().run, run_row, idx, row
+                            )
+                        )
+                    if not pending:
+                        break
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        result = future.result()
+                        f.write(json.dumps(result, ensure_ascii=False) + "\n")
+                        f.flush()
+                        completed += 1
+                        if "error" in result:
+                            errors += 1
+                            continue
+                        if example is None:
+                            example = result
+                        for bullet in extract_bullets(result["evaluation"]):
+                            # Count rephrasings that only differ in case or
+                            # punctuation together, shown as first seen
+                            key = re.sub(r"\W+", " ", bullet.lower()).strip()
+                            wording.setdefault(key, bullet)
+                            recommendations[key] += 1
+                    yield {
+                        "rows": completed,
+                        "errors": errors,
+                        "results_path": results_path,
+                    }
+        finally:
+            for pool in (row_pool, openai_pool, bedrock_pool):
+                pool.shutdown(wait=False, cancel_futures=True)
+
+        summary = "\n".join(
+            f"- {wording[key]} ({count}/{completed - errors} rows)"
+            for key, count in recommendations.most_common(summary_top_k)
+        )
+        revised = None
+        if example is not None and summary:
+            revised = self.generate_revised_prompt(
+                f"<recommendation>\n{summary}\n</recommendation>",
+                revised_prompt,
+                example["openai"],
+                example["bedrock"],
+                eval_model_id,
+            )
+        yield {
+            "rows": completed,
+            "errors": errors,
+            "results_path": results_path,
+            "summary": summary,
+            "revised_prompt": revised,
+        }
+
+    def auto_align(
+        self,
+        original_prompt,
+        original_kv_string,
+        prompt,
+        kv_string,
+        openai_model_id,
+        aws_model_id,
+        eval_model_id,
+        max_rounds=3,
+        similarity_threshold=None,
+        openai_reference=None,
+        artifacts_path=None,
+    ):
+        """
+        Repeat Bedrock invocation -> evaluate_response -> generate_revised_prompt
+        on the Claude `prompt` until its response matches the OpenAI reference.
+
+        The reference for `original_prompt` is generated once (or taken from
+        `openai_reference`) and reused every round; only the Claude side is
+        re-executed. `original_kv_string` and `kv_string` fill the variables
+        of the two prompts, see insert_kv. Stops after `max_rounds`, when the
+        response reaches `similarity_threshold` with the same structure (see
+        similarity.compare_outputs), or when a revision repeats an earlier
+        prompt.
+
+        Yields each round's artifacts (also appended to the JSONL
+        `artifacts_path`), then a final dict with the `stop_reason` and the
+        `best_prompt` by similarity.
+        """
+        if similarity_threshold is None:
+            similarity_threshold = alignment_similarity_threshold
+        if artifacts_path is None:
+            os.makedirs(results_dir, exist_ok=True)
+            artifacts_path = os.path.join(
+                results_dir, f"alignment_rounds_{int(time.time())}.jsonl"
+            )
+        reference = openai_reference or self.generate_openai_response(
+            self.insert_kv(original_prompt, original_kv_string), openai_model_id
+        )
+        seen = {prompt.strip()}
+        best = None
+        stop_reason = "max_rounds"
+        with open(artifacts_path, "a", encoding="utf-8") as f:
+            for round_idx in range(1, max_rounds + 1):
+                aws_response = self.generate_bedrock_response(
+                    self.insert_kv(prompt, kv_string), aws_model_id
+                )
+                comparison = compare_outputs(reference, aws_response)
+                similarity = comparison["score"]
+                artifact = {
+                    "round": round_idx,
+                    "prompt": prompt,
+                    "bedrock": aws_response,
+                    "similarity": similarity,
+                }
+                if best is None or similarity > best["similarity"]:
+                    best = artifact
+                if similarity >= similarity_threshold and not comparison["differences"]:
+                    stop_reason = "similarity"
+                else:
+                    artifact["evaluation"] = self.evaluate_response(
+                        reference, aws_response, eval_model_id, similarity_threshold
+                    )
+                    artifact["revised_prompt"] = self.generate_revised_prompt(
+                        artifact["evaluation"],
+                        prompt,
+                        reference,
+                        aws_response,
+                        eval_model_id,
+                    )
+                    if artifact["revised_prompt"].strip() in seen:
+                        stop_reason = "repeat"
+                f.write(json.dumps(artifact, ensure_ascii=False) + "\n")
+                f.flush()
+                yield artifact
+                if stop_reason != "max_rounds":
+                    break
+                prompt = artifact["revised_prompt"]
+                seen.add(prompt.strip())
+        yield {
+            "stop_reason": stop_reason,
+            "rounds": round_idx,
+            "reference": reference,
+            "best_prompt": best["prompt"],
+            "best_similarity": best["similarity"],
+            "artifacts_path": artifacts_path,
+        }
+
     def insert_kv(self, user_prompt, kv_string):
         # Split the key-value string by ';' to get individual pairs
         kv_pairs = kv_string.split(";")
+        values = {}
         for pair in kv_pairs:
             if ":" in pair:
                 key, value = pair.split(":", 1)  # Only split on the first ':'
-                user_prompt = user_prompt.replace(f"{{{key}}}", value)
-        return user_prompt
+                values[key.strip()] = value
+        return render_prompt(user_prompt, values)
 
     def generate_revised_prompt(
         self, feedback, prompt, openai_response, aws_response, eval_model_id
@@ -219,9 +544,26 @@ class Alignment:
             _OpenAI=openai_response,
             _Bedrock=aws_response,
         )
-        aws_result = self.generate_bedrock_response(revised_prompt, eval_model_id)
-        pattern = r"<revised_prompt>(.*?)</revised_prompt>"
-        matches = re.findall(pattern, aws_result, re.DOTALL)
-        # remove all the \n and []
-        matches = matches[0]  # .replace("\n", "").replace("[", "").replace("]", "")
-        return matches.strip()
+        # Extract <revised_prompt> as it streams and stop at its closing tag
+        parser = TagStreamParser("revised_prompt")
+        deltas = invoke_model_stream(
+            self.bedrock_client, self.build_bedrock_body(revised_prompt), eval_model_id
+        )
+        for _ in parser.consume(deltas):
+            pass
+        if not parser.closed:
+            raise ValueError("No <revised_prompt> found in the model response")
+        return parser.content.strip()
+
+
+def extract_bullets(evaluation):
+    """Return the recommendation bullet points of an evaluate_response result."""
+    matches = re.findall(
+        r"<recommendation>(.*?)</recommendation>", evaluation, re.DOTALL
+    )
+    bullets = []
+    for line in (matches[0] if matches else "").splitlines():
+        line = re.sub(r"^\s*(?:[-*•]|\d+[.)])\s*", "", line).strip()
+        if line:
+            bullets.append(line)
+    return bullets
@@ -1,70 +1,156 @@
 import json
+import logging
 
-import boto3
-from botocore.config import Config
+from bedrock import get_bedrock_client, invoke_model
+from concurrency import bounded_map
+from dedup import cluster
+from short_answer import ask_short_answer
+from template import render_prompt
+from tournament import Tournament
 
-region_name = "us-west-2"
-session = boto3.Session()
-retry_config = Config(
-    region_name=region_name,
-    retries={
-        "max_attempts": 5,
-        "mode": "standard",
-    },
-)
-service_name = "bedrock-runtime"
-bedrock_client = session.client(service_name=service_name, config=retry_config)
+logger = logging.getLogger(__name__)
+
+bedrock_client = get_bedrock_client()
 
 
 class Rater:
-    def __init__(self):
-        pass
+    def __init__(
+        self, max_workers=None, mode=None, both_orders=True, dedup_threshold=0.85
+    ):
+        # max_workers bounds concurrent model calls, 1 runs them sequentially
+        self.max_workers = max_workers
+        # None rates all candidates in a single prompt, otherwise one of
+        # tournament.tournament_modes ranks them with pairwise comparisons
+        self.mode = mode
+        self.both_orders = both_orders
+        # Candidates whose prompts cluster together (see dedup.cluster) share
+        # one output and verdict; None disables the dedup stage
+        self.dedup_threshold = dedup_threshold
+        self.calls_avoided = 0
 
     def __call__(self, initial_prompt, candidates, demo_data):
+        """Return the index of the best candidate."""
+        if not candidates:
+            raise ValueError("No candidates to rate")
+        if self.mode is not None:
+            return self.rank(initial_prompt, candidates, demo_data)[0]
+        representatives = self.representatives(candidates)
+        unique = [candidates[idx] for idx in representatives]
+        initial_prompt = self.fill_outputs(initial_prompt, unique, demo_data)
+        self.record_avoided(len(candidates) - len(unique))
+        if len(unique) == 1:
+            return representatives[0]
+        rate = self.rater(initial_prompt, unique)
+        return representatives[rate]
+
+    def rank(self, initial_prompt, candidates, demo_data, mode=None):
+        """
+        Return the candidate indices, best first, from a tournament of
+        pairwise comparisons (knockout unless `mode` or self.mode says
+        otherwise).
+        """
+        assignment = self.assignment(candidates)
+        representatives = sorted(set(assignment))
+        unique = [candidates[idx] for idx in representatives]
+        initial_prompt = self.fill_outputs(initial_prompt, unique, demo_data)
+        tournament = Tournament(
+            lambda i, j: self.compare(
+                initial_prompt, unique[i]["output"], unique[j]["output"]
+            ),
+            mode=mode or self.mode or "knockout",
+            both_orders=self.both_orders,
+            max_workers=self.max_workers,
+        )
+        self.record_avoided(
+            len(candidates)
+            - len(unique)
+            + tournament.comparisons_needed(len(candidates))
+            - tournament.comparisons_needed(len(unique))
+        )
+        # Duplicates share their representative's place, right after it
+        ranking = []
+        for idx in tournament.rank(len(unique)):
+            ranking += [
+                member
+                for member, rep in enumerate(assignment)
+                if rep == representatives[idx]
+            ]
+        return ranking
+
+    def rank_calls(self, n, pending_outputs=0, mode=None):
+        """
+        Upper bound of the model calls rank makes for `n` candidates of which
+        `pending_outputs` have no output yet; dedup and cached judgements
+        only lower it.
+        """
+        tournament = Tournament(
+            None, mode=mode or self.mode or "knockout", both_orders=self.both_orders
+        )
+        return pending_outputs + tournament.comparisons_needed(n)
+
+    def assignment(self, candidates):
+        if self.dedup_threshold is None:
+            return list(range(len(candidates)))
+        return cluster(
+            [candidate["prompt"] for candidate in candidates], self.dedup_threshold
+        )
+
+    def representatives(self, candidates):
+        return sorted(set(self.assignment(candidates)))
+
+    def record_avoided(self, calls):
+        if calls > 0:
+            logger.info("Dedup avoided %d model calls", calls)
+            self.calls_avoided += calls
+
+    def fill_outputs(self, initial_prompt, candidates, demo_data):
+        """
+        Run the candidates that have no output yet on demo_data and return the
+        initial prompt with demo_data filled in.
+        """
+        pending = []
         for candidate in candidates:
             if "output" in candidate:
                 continue
-            candidate_prompt = candidate["prompt"]
-            for k, v in demo_data.items():
-                candidate_prompt = candidate_prompt.replace(k, v)
-            candidate["input"] = candidate_prompt
-            candidate["output"] = self.get_output(candidate_prompt)
-        for k, v in demo_data.items():
-            initial_prompt = initial_prompt.replace(k, v)
-        rate = self.rater(initial_prompt, candidates)
-        return rate
+            candidate["input"] = render_prompt(candidate["prompt"], demo_data)
+            pending.append(candidate)
+        outputs = bounded_map(
+            self.get_output,
+            [candidate["input"] for candidate in pending],
+            max_workers=self.max_workers,
+        )
+        for candidate, output in zip(pending, outputs):
+            candidate["output"] = output
+        return render_prompt(initial_prompt, demo_data)
 
     def get_output(self, prompt):
         messages = [{"role": "user", "content": prompt}]
-        body = json.dumps(
-            {
-                "messages": messages,
-                "max_tokens": 4096,
-                "temperature": 0.8,
-                "top_k": 50,
-                "top_p": 1,
-                "stop_sequences": ["\n\nHuman:"],
-                "anthropic_version": "bedrock-2023-05-31",
-            }
-        )
+        body = {
+            "messages": messages,
+            "max_tokens": 4096,
+            "temperature": 0.8,
+            "top_k": 50,
+            "top_p": 1,
+            "stop_sequences": ["\n\nHuman:"],
+            "anthropic_version": "bedrock-2023-05-31",
+        }
         modelId = "anthropic.claude-3-haiku-20240307-v1:0"  # anthropic.claude-3-sonnet-20240229-v1:0 "anthropic.claude-3-haiku-20240307-v1:0"
-        accept = "application/json"
-        contentType = "application/json"
-
-        response = bedrock_client.invoke_model(
-            body=body, modelId=modelId, accept=accept, contentType=contentType
-        )
-        response_body = json.loads(response.get("body").read())
+        response_body = invoke_model(bedrock_client, body, modelId)
         result = response_body["content"][0]["text"]
         return result
 
     def rater(self, initial_prompt, candidates):
+        if not candidates:
+            raise ValueError("No candidates to rate")
+        if len(candidates) == 1:
+            return 0
         rater_example = json.dumps({"Preferred": "Response 1"})
         Response_prompt = []
         for candidate_idx, candidate in enumerate(candidates):
             Response_template = f"""
 Response {candidate_idx+1}:
-{candidate}
+<response_{candidate_idx+1}>
+{candidate["output"]}
 </response_{candidate_idx+1}>
 """.strip()
             Response_prompt.append(Response_template)
@@ -85,46 +171,66 @@ Finally, select which response is the most helpful and honest.
 Use JSON format with key `Preferred` when returning results. Please only output the result in json format, and do the json format check and return, don't include other extra text! An example of output is as follows:
 Output example: {rater_example}
 """.strip()
-        messages = [
-            {
-                "role": "user",
-                "content": rater_prompt.format(
-                    instruction=initial_prompt,
-                    Response_prompt=Response_prompt,
-                    rater_example=rater_example,
-                ),
-            },
-            {"role": "assistant", "content": "{"},
-        ]
-        body = json.dumps(
-            {
-                "messages": messages,
-                "max_tokens": 4096,
-                "temperature": 0.8,
-                "top_k": 50,
-                "top_p": 1,
-                "stop_sequences": ["\n\nHuman:"],
-                "anthropic_version": "bedrock-2023-05-31",
-            }
-        )
+        choices = [f"Response {idx + 1}" for idx in range(len(candidates))]
         modelId = "anthropic.claude-3-sonnet-20240229-v1:0"  # anthropic.claude-3-sonnet-20240229-v1:0 "anthropic.claude-3-haiku-20240307-v1:0"
-        accept = "application/json"
-        contentType = "application/json"
+        # An unreadable verdict keeps the first candidate, which the APE
+        # epoch loop passes in as the incumbent
+        answer = ask_short_answer(
+            bedrock_client,
+            modelId,
+            rater_prompt.format(
+                instruction=initial_prompt,
+                Response_prompt=Response_prompt,
+                rater_example=rater_example,
+            ),
+            {"Preferred": choices},
+            fallback={"Preferred": choices[0]},
+        )
+        return choices.index(answer["Preferred"])
 
-        response = bedrock_client.invoke_model(
-            body=body, modelId=modelId, accept=accept, contentType=contentType
+    def compare(self, initial_prompt, response_a, response_b):
+        """
+        Judge two responses to the same instruction. Returns 0 when the first
+        response is preferred, 1 for the second and None when the verdict
+        cannot be parsed.
+        """
+        rater_example = json.dumps({"Preferred": "Response 1"})
+        rater_prompt = """
+You are an expert rater of helpful and honest Assistant responses. Given the instruction and the two responses choose the most helpful and honest response.
+Please pay particular attention to the response formatting requirements called for in the instruction.
+
+Instruction:
+<instruction>
+{instruction}
+</instruction>
+
+Response 1:
+<response_1>
+{response_a}
+</response_1>
+
+Response 2:
+<response_2>
+{response_b}
+</response_2>
+
+Finally, select which response is the most helpful and honest.
+
+Use JSON format with key `Preferred` when returning results. Please only output the result in json format, and do the json format check and return, don't include other extra text! An example of output is as follows:
+Output example: {rater_example}
+""".strip()
+        modelId = "anthropic.claude-3-sonnet-20240229-v1:0"
+        answer = ask_short_answer(
+            bedrock_client,
+            modelId,
+            rater_prompt.format(
+                instruction=initial_prompt,
+                response_a=response_a,
+                response_b=response_b,
+                rater_example=rater_example,
+            ),
+            {"Preferred": ["Response 1", "Response 2"]},
         )
-        response_body = json.loads(response.get("body").read())
-        result_json = "{" + response_body["content"][0]["text"]
-        try:
-            result = None
-            result_json = json.loads(result_json)
-            for idx in range(len(candidates)):
-                if str(idx + 1) in result_json["Preferred"]:
-                    result = idx
-                    break
-        except:
-            result = random.ranint(0, len(candidates) - 1)
-        if result is None:
-            result = random.ranint(0, len(candidates) - 1)
-        return result
+        if answer is None:
+            return None
+        return 0 if answer["Preferred"] == "Response 1" else 1
@@ -0,0 +1,91 @@
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+
+import sklearn
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import linear_kernel
+
+logger = logging.getLogger(__name__)
+
+cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+
+
+def estimate_tokens(text):
+    # Roughly 4 characters per token for English text
+    return len(text) // 4 + 1
+
+
+class LexicalIndex:
+    """
+    TF-IDF index over a fixed list of documents.
+
+    The fitted vectorizer and document matrix are persisted under `name` in
+    the cache directory, keyed by a hash of the documents and the
+    scikit-learn version, so the index is only recomputed when either
+    changes. A cache file that cannot be loaded is rebuilt.
+    """
+
+    def __init__(self, documents, name=None):
+        self.documents = list(documents)
+        digest = hashlib.sha256(
+            "\0".join([sklearn.__version__] + self.documents).encode("utf-8")
+        ).hexdigest()
+        path = os.path.join(cache_dir, f"{name}-{digest[:16]}.pkl") if name else None
+        if path and os.path.exists(path):
+            try:
+                with open(path, "rb") as f:
+                    self.vectorizer, self.matrix = pickle.load(f)
+                return
+            except Exception as e:
+                logger.warning("Rebuilding index, cannot load %s: %s", path, e)
+        self.vectorizer = TfidfVectorizer(
+            sublinear_tf=True, stop_words="english", ngram_range=(1, 2)
+        )
+        self.matrix = self.vectorizer.fit_transform(self.documents)
+        if path:
+            self.save(path)
+
+    def save(self, path):
+        # Write to a temporary file first so a crash never leaves a truncated
+        # cache file behind
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                "wb", dir=cache_dir, suffix=".tmp", delete=False
+            ) as f:
+                pickle.dump((self.vectorizer, self.matrix), f)
+            os.replace(f.name, path)
+        except OSError as e:
+            logger.warning("Cannot persist index to %s: %s", path, e)
+
+    def scores(self, query):
+        return linear_kernel(self.vectorizer.transform([query]), self.matrix)[0]
+
+    def search(self, query, top_k=None):
+        """Return `(index, score)` pairs, best match first."""
+        scores = self.scores(query)
+        ranked = sorted(range(len(scores)), key=lambda idx: -scores[idx])
+        return [(idx, scores[idx]) for idx in ranked[:top_k]]
+
+    def select(self, query, top_k=None, token_budget=None, cost=estimate_tokens):
+        """
+        Pick the best matching documents for `query`, at most `top_k` of them
+        and within `token_budget` total cost. Documents with no lexical match
+        still fill the remaining slots in document order, since most queries
+        share no terms with most documents. Returns indices in document order
+        so the selection reads like the original text.
+        """
+        selected = []
+        used = 0
+        for idx, _ in self.search(query):
+            if top_k is not None and len(selected) >= top_k:
+                break
+            size = cost(self.documents[idx])
+            if token_budget is not None and used + size > token_budget:
+                continue
+            selected.append(idx)
+            used += size
+        return sorted(selected)
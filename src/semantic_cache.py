@@ -0,0 +1,168 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from dedup import MinHasher, normalize
+from template import compile_template
+
+
+def abstract_variables(text):
+    """
+    Replace the placeholders of `text` with positional names (`__var_1__`,
+    ...) in order of first appearance. Returns the abstracted text and the
+    original names, so prompts that only differ in variable names or
+    placeholder syntax abstract equal.
+    """
+    template = compile_template(text)
+    mapping = {
+        name: f"__var_{idx + 1}__" for idx, name in enumerate(template.variables)
+    }
+    return template.render(mapping), template.variables
+
+
+def canonical_tokens(key):
+    """Word tokens of a normalized prompt, ignoring punctuation."""
+    return tuple(re.findall(r"\w+", key))
+
+
+class SemanticCache:
+    """
+    In-memory cache of rewrites keyed by prompt similarity rather than exact
+    text.
+
+    Prompts are abstracted (variable names, case and whitespace) and indexed
+    by MinHash LSH over character shingles. A lookup only returns the rewrite
+    of a cached prompt whose estimated Jaccard similarity reaches `threshold`
+    and whose words are the same, so prompts that differ only in variable
+    names, whitespace, case or punctuation share a rewrite while a changed
+    word ("polite" -> "rude", a different company name) is a miss. The
+    variable names are mapped back to the new prompt's.
+    Entries are scoped (e.g. by language and guide variant), expire after
+    `ttl` seconds and are evicted least-recently-used beyond `max_entries`
+    entries or `max_chars` stored characters.
+    """
+
+    def __init__(
+        self,
+        threshold=0.95,
+        max_entries=1000,
+        max_chars=5_000_000,
+        ttl=24 * 3600,
+        num_perm=64,
+        bands=16,
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.ttl = ttl
+        self.hasher = MinHasher(num_perm=num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.buckets = {}
+        self.chars = 0
+        self.hits = 0
+        self.misses = 0
+        self._next_id = 0
+
+    def band_keys(self, scope, signature):
+        return [
+            (scope, band, tuple(signature[band * self.rows : (band + 1) * self.rows]))
+            for band in range(self.bands)
+        ]
+
+    def get(self, prompt, scope=None):
+        """Return the cached rewrite for a near-identical prompt, or None."""
+        abstract, names = abstract_variables(prompt)
+        key = normalize(abstract)
+        tokens = canonical_tokens(key)
+        signature = self.hasher.signature(key)
+        now = time.time()
+        with self.lock:
+            candidates = set()
+            for band_key in self.band_keys(scope, signature):
+                candidates |= self.buckets.get(band_key, set())
+            best = None
+            best_similarity = self.threshold
+            for entry_id in candidates:
+                entry = self.entries[entry_id]
+                if self.ttl and now - entry["created_at"] > self.ttl:
+                    self._remove(entry_id)
+                    continue
+                # The rewrite can only be mapped back variable for variable
+                if len(entry["names"]) != len(names):
+                    continue
+                # Similar shingles are only a candidate, any changed word
+                # may change the instruction
+                if entry["tokens"] != tokens:
+                    continue
+                similarity = (
+                    1.0
+                    if entry["key"] == key
+                    else self.hasher.similarity(signature, entry["signature"])
+                )
+                if similarity >= best_similarity:
+                    best, best_similarity = entry_id, similarity
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(best)
+            rewrite = self.entries[best]["rewrite"]
+        mapping = {f"__var_{idx + 1}__": name for idx, name in enumerate(names)}
+        return compile_template(rewrite).rename(mapping)
+
+    def put(self, prompt, rewrite, scope=None):
+        abstract, names = abstract_variables(prompt)
+        mapping = {name: f"__var_{idx + 1}__" for idx, name in enumerate(names)}
+        key = normalize(abstract)
+        entry = {
+            "key": key,
+            "tokens": canonical_tokens(key),
+            "names": names,
+            "rewrite": compile_template(rewrite).rename(mapping),
+            "signature": self.hasher.signature(key),
+            "scope": scope,
+            "created_at": time.time(),
+        }
+        entry["size"] = len(entry["key"]) + len(entry["rewrite"])
+        with self.lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self.entries[entry_id] = entry
+            self.chars += entry["size"]
+            for band_key in self.band_keys(scope, entry["signature"]):
+                self.buckets.setdefault(band_key, set()).add(entry_id)
+            while self.entries and (
+                len(self.entries) > self.max_entries or self.chars > self.max_chars
+            ):
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, entry_id):
+        entry = self.entries.pop(entry_id)
+        self.chars -= entry["size"]
+        for band_key in self.band_keys(entry["scope"], entry["signature"]):
+            bucket = self.buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self.buckets[band_key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.buckets.clear()
+            self.chars = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+                "chars": self.chars,
+            }
@@ -0,0 +1,98 @@
+import json
+import re
+
+from bedrock import invoke_model
+
+
+def max_tokens_for(schema):
+    """
+    Token allowance for a one-line JSON object with the keys of `schema`, each
+    set to its longest choice: roughly 3 characters per token plus headroom.
+    """
+    text = json.dumps(
+        {key: max(choices, key=len) for key, choices in schema.items()},
+        ensure_ascii=False,
+    )
+    return len(text) // 3 + 8
+
+
+def build_short_answer_body(content, schema):
+    """
+    Request body for a short JSON answer: the assistant turn is prefilled
+    with "{", generation stops at the closing "}", temperature is 0 so the
+    answer is repeatable (and cacheable), and max_tokens only covers the
+    expected object.
+    """
+    return {
+        "messages": [
+            {"role": "user", "content": content},
+            {"role": "assistant", "content": "{"},
+        ],
+        "max_tokens": max_tokens_for(schema),
+        "temperature": 0,
+        "stop_sequences": ["}"],
+        "anthropic_version": "bedrock-2023-05-31",
+    }
+
+
+def parse_json_fields(text):
+    """
+    Read the string/number fields of a possibly truncated or chatty JSON
+    object, e.g. `"Preferred": "Response 2"` without its closing brace or with
+    text after it.
+    """
+    text = text.strip()
+    try:
+        value = json.loads(text)
+        if isinstance(value, dict):
+            return value
+    except json.JSONDecodeError:
+        pass
+    fields = {}
+    for match in re.finditer(
+        r'"([^"]+)"\s*:\s*(?:"((?:[^"\\]|\\.)*)"?|([-\w.]+))', text
+    ):
+        key, string, bare = match.groups()
+        fields.setdefault(key, string if string is not None else bare)
+    return fields
+
+
+def match_choice(value, choices):
+    """Map a model answer to one of `choices`, or None."""
+    if value is None:
+        return None
+    value = str(value).strip().lower()
+    lowered = [choice.lower() for choice in choices]
+    if value in lowered:
+        return choices[lowered.index(value)]
+    # "2" or "response 2." for "Response 2"
+    digits = re.findall(r"\d+", value)
+    if digits:
+        numbered = [
+            choice for choice in choices if re.findall(r"\d+", choice) == digits
+        ]
+        if len(numbered) == 1:
+            return numbered[0]
+    contained = [choice for choice in choices if choice.lower() in value]
+    if len(contained) == 1:
+        return contained[0]
+    return None
+
+
+def ask_short_answer(client, model_id, content, schema, fallback=None, use_cache=None):
+    """
+    Ask for a JSON object whose keys and allowed values are given by `schema`
+    (`{key: [choices]}`) and return `{key: choice}`.
+
+    Returns `fallback` when any key is missing or does not match one of its
+    choices, so callers always get a deterministic answer.
+    """
+    body = build_short_answer_body(content, schema)
+    response_body = invoke_model(client, body, model_id, use_cache=use_cache)
+    fields = parse_json_fields("{" + response_body["content"][0]["text"] + "}")
+    answer = {
+        key: match_choice(fields.get(key), choices) for key, choices in schema.items()
+    }
+    if any(choice is None for choice in answer.values()):
+        return fallback
+    return answer
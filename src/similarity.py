@@ -0,0 +1,116 @@
+import json
+import re
+
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+
+# CJK characters count as one token each, other text splits into words
+token_pattern = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]|\w+")
+
+
+def tokenize(text):
+    return token_pattern.findall(text.lower())
+
+
+def tfidf_cosine(a, b):
+    """Cosine similarity of character n-gram TF-IDF vectors, language-agnostic."""
+    if not a.strip() or not b.strip():
+        return 1.0 if a.strip() == b.strip() else 0.0
+    vectorizer = TfidfVectorizer(
+        analyzer="char_wb", ngram_range=(2, 4), sublinear_tf=True
+    )
+    matrix = vectorizer.fit_transform([a, b])
+    return float(cosine_similarity(matrix[0], matrix[1])[0][0])
+
+
+def lcs_length(a, b):
+    """Longest common subsequence length of two token lists (bit-parallel)."""
+    if not a or not b:
+        return 0
+    masks = {}
+    for idx, token in enumerate(a):
+        masks[token] = masks.get(token, 0) | (1 << idx)
+    full = (1 << len(a)) - 1
+    v = full
+    for token in b:
+        u = v & masks.get(token, 0)
+        v = ((v + u) | (v - u)) & full
+    return len(a) - bin(v).count("1")
+
+
+def rouge_l(reference, candidate):
+    """ROUGE-L F1 of `candidate` against `reference`."""
+    reference_tokens = tokenize(reference)
+    candidate_tokens = tokenize(candidate)
+    lcs = lcs_length(reference_tokens, candidate_tokens)
+    if lcs == 0:
+        return 1.0 if not reference_tokens and not candidate_tokens else 0.0
+    precision = lcs / len(candidate_tokens)
+    recall = lcs / len(reference_tokens)
+    return 2 * precision * recall / (precision + recall)
+
+
+def is_json(text):
+    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text.strip())
+    if not text.startswith(("{", "[")):
+        return False
+    try:
+        json.loads(text)
+    except json.JSONDecodeError:
+        return False
+    return True
+
+
+def structure(text):
+    """Shape of a response: xml tags used, JSON or not, and markdown counts."""
+    lines = text.splitlines()
+    return {
+        "xml tags": sorted(set(re.findall(r"</?([A-Za-z_][\w.-]*)[^<>]*>", text))),
+        "json": is_json(text),
+        "headings": sum(bool(re.match(r"\s*#{1,6} ", line)) for line in lines),
+        "bullet items": sum(bool(re.match(r"\s*[-*+•] ", line)) for line in lines),
+        "numbered items": sum(bool(re.match(r"\s*\d+[.)] ", line)) for line in lines),
+        "table rows": sum(line.strip().startswith("|") for line in lines),
+        "code blocks": text.count("```") // 2,
+    }
+
+
+def structural_differences(reference, candidate):
+    reference_shape = structure(reference)
+    candidate_shape = structure(candidate)
+    return [
+        f"{feature}: reference {reference_shape[feature]}, "
+        f"candidate {candidate_shape[feature]}"
+        for feature in reference_shape
+        if reference_shape[feature] != candidate_shape[feature]
+    ]
+
+
+def compare_outputs(reference, candidate):
+    """
+    Score how closely `candidate` matches `reference` without a model call.
+
+    Returns the `tfidf` cosine, `rouge_l` F1, their mean as `score`, and the
+    list of structural `differences` (xml tags, JSON, markdown shape).
+    """
+    tfidf = tfidf_cosine(reference, candidate)
+    rouge = rouge_l(reference, candidate)
+    return {
+        "tfidf": tfidf,
+        "rouge_l": rouge,
+        "score": (tfidf + rouge) / 2,
+        "differences": structural_differences(reference, candidate),
+    }
+
+
+def format_signals(comparison):
+    lines = [
+        f"TF-IDF cosine similarity: {comparison['tfidf']:.2f}",
+        f"ROUGE-L F1: {comparison['rouge_l']:.2f}",
+    ]
+    if comparison["differences"]:
+        lines.append("Structural differences:")
+        lines += [f"- {difference}" for difference in comparison["differences"]]
+    else:
+        lines.append("Structure: same xml tags, JSON and markdown shape")
+    return "\n".join(lines)
@@ -0,0 +1,87 @@
+import re
+
+
+class TagStreamParser:
+    """
+    Incremental extractor for the contents of an xml tag in a token stream.
+
+    feed() takes text deltas in arrival order and returns the part of the
+    tag's contents that is now known, holding back any suffix that could be
+    the start of the closing tag. Only the first occurrence of the tag is
+    extracted, and `closed` turns true once its closing tag has been seen.
+    """
+
+    def __init__(self, tag, opened=False):
+        self.open_tag = f"<{tag}>"
+        self.close_tag = f"</{tag}>"
+        # opened=True when the opening tag was sent as an assistant prefill
+        self.opened = opened
+        self.closed = False
+        self.text = ""
+        self.content = ""
+        self._pending = ""
+
+    def feed(self, delta):
+        self.text += delta
+        if self.closed:
+            return ""
+        if not self.opened:
+            # Only the new delta and a possible split opening tag need scanning
+            start = self.text.find(
+                self.open_tag, max(0, len(self.text) - len(delta) - len(self.open_tag))
+            )
+            if start == -1:
+                return ""
+            self.opened = True
+            self._pending = self.text[start + len(self.open_tag) :]
+        else:
+            self._pending += delta
+        end = self._pending.find(self.close_tag)
+        if end != -1:
+            emitted = self._pending[:end]
+            self.closed = True
+            self._pending = ""
+        else:
+            # Hold back a possible partial closing tag at the end
+            keep = 0
+            for size in range(min(len(self.close_tag) - 1, len(self._pending)), 0, -1):
+                if self.close_tag.startswith(self._pending[-size:]):
+                    keep = size
+                    break
+            emitted = self._pending[: len(self._pending) - keep]
+            self._pending = self._pending[len(self._pending) - keep :]
+        self.content += emitted
+        return emitted
+
+    def consume(self, deltas):
+        """
+        Feed a delta generator through the parser, yielding content deltas.
+
+        The upstream generator is closed as soon as the closing tag is seen, so
+        a model stream stops being read instead of running to the end.
+        """
+        try:
+            for delta in deltas:
+                emitted = self.feed(delta)
+                if emitted:
+                    yield emitted
+                if self.closed:
+                    break
+        finally:
+            if hasattr(deltas, "close"):
+                deltas.close()
+
+
+def extract_numbered_tags(text, tag, n):
+    """
+    Return the contents of `<tag_1>` ... `<tag_n>` in `text`, None for the ones
+    that are missing. A tag left unterminated (e.g. cut by a stop sequence or
+    max_tokens) runs to the next numbered tag or the end of the text.
+    """
+    results = []
+    for idx in range(1, n + 1):
+        match = re.search(
+            rf"<{tag}_{idx}>(.*?)(?:</{tag}_{idx}>|<{tag}_\d+>|\Z)", text, re.DOTALL
+        )
+        results.append(match.group(1) if match else None)
+    return results
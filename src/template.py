@@ -0,0 +1,96 @@
+import functools
+import re
+
+# {{var}} (any text without braces), {$VAR} and {var} placeholders
+placeholder_pattern = re.compile(
+    r"\{\{\s*([^{}]+?)\s*\}\}|\{\$([A-Za-z_]\w*)\}|\{([A-Za-z_][\w.-]*)\}"
+)
+
+
+@functools.lru_cache(maxsize=4096)
+def variable_name(key):
+    """Map a placeholder like `{{document}}` or `{$DOC}` to its bare name."""
+    match = placeholder_pattern.fullmatch(key)
+    if match is None:
+        return key
+    return next(group for group in match.groups() if group is not None)
+
+
+class Template:
+    """
+    A prompt template parsed once into literal text and placeholders, then
+    rendered for any number of value rows in a single pass.
+
+    Values may be keyed by bare name (`document`) or by placeholder
+    (`{{document}}`). Substituted values are never scanned again, so a value
+    that itself contains a placeholder is inserted verbatim. Placeholders with
+    no value are left as they are.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.literals = []
+        self.placeholders = []
+        self.names = []
+        position = 0
+        for match in placeholder_pattern.finditer(text):
+            self.literals.append(text[position : match.start()])
+            self.placeholders.append(match.group(0))
+            self.names.append(
+                next(group for group in match.groups() if group is not None)
+            )
+            position = match.end()
+        self.literals.append(text[position:])
+        self.variables = list(dict.fromkeys(self.names))
+
+    def normalize(self, values):
+        return {variable_name(key): value for key, value in values.items()}
+
+    def render(self, values):
+        values = self.normalize(values)
+        parts = [self.literals[0]]
+        for placeholder, name, literal in zip(
+            self.placeholders, self.names, self.literals[1:]
+        ):
+            value = values.get(name)
+            parts.append(placeholder if value is None else str(value))
+            parts.append(literal)
+        return "".join(parts)
+
+    def rename(self, mapping):
+        """
+        Return the text with variables renamed per `mapping` (bare names),
+        keeping each placeholder's syntax.
+        """
+        parts = [self.literals[0]]
+        for placeholder, name, literal in zip(
+            self.placeholders, self.names, self.literals[1:]
+        ):
+            if name in mapping:
+                placeholder = placeholder.replace(name, mapping[name], 1)
+            parts.append(placeholder)
+            parts.append(literal)
+        return "".join(parts)
+
+    def render_many(self, rows):
+        return [self.render(values) for values in rows]
+
+    def missing(self, values):
+        """Template variables that have no value in `values`."""
+        names = self.normalize(values)
+        return [name for name in self.variables if name not in names]
+
+    def unused(self, values):
+        """Keys of `values` that do not appear in the template."""
+        variables = set(self.variables)
+        return [key for key in values if variable_name(key) not in variables]
+
+
+@functools.lru_cache(maxsize=256)
+def compile_template(text):
+    """Return the Template for `text`, parsed once and reused across calls."""
+    return Template(text)
+
+
+def render_prompt(text, values):
+    return compile_template(text).render(values)
@@ -0,0 +1,54 @@
+import time
+
+from concurrency import bounded_map, merge_streams
+
+
+def slow(items, delay):
+    for item in items:
+        time.sleep(delay)
+        yield item
+
+
+def test_merge_streams_interleaves_in_arrival_order():
+    events = list(merge_streams([slow(["a1", "a2"], 0.05), slow(["b1"], 0.01)]))
+    assert events[0] == (1, "b1")
+    assert sorted(events) == [(0, "a1"), (0, "a2"), (1, "b1")]
+
+
+def test_merge_streams_reports_errors_and_keeps_other_streams():
+    def failing():
+        yield "partial"
+        raise ValueError("boom")
+
+    events = list(merge_streams([failing(), slow(["ok"], 0.02)]))
+    assert (0, "partial") in events
+    errors = [value for idx, value in events if isinstance(value, Exception)]
+    assert len(errors) == 1 and str(errors[0]) == "boom"
+    assert (1, "ok") in events
+
+
+def test_merge_streams_times_out_slow_stream():
+    closed = []
+
+    def stuck():
+        try:
+            yield "first"
+            time.sleep(1)
+            yield "late"
+        finally:
+            closed.append(True)
+
+    start = time.monotonic()
+    events = list(merge_streams([stuck(), slow(["fast"], 0.01)], timeouts=[0.2, None]))
+    assert time.monotonic() - start < 0.9
+    assert (0, "first") in events and (1, "fast") in events
+    assert (0, "late") not in events
+    timeout = events[-1]
+    assert timeout[0] == 0 and isinstance(timeout[1], TimeoutError)
+    # The abandoned stream is closed once its pending item arrives
+    time.sleep(1)
+    assert closed == [True]
+
+
+def test_bounded_map_keeps_order():
+    assert bounded_map(lambda x: x * 2, [3, 1, 2], max_workers=2) == [6, 2, 4]
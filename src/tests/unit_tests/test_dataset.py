@@ -0,0 +1,129 @@
+import json
+import random
+
+import pytest
+
+from dataset import Checkpoint, DatasetEvaluator, row_keys, wilson_interval
+
+
+class FakeRater:
+    both_orders = False
+
+    def __init__(self, fail_after=None):
+        self.calls = 0
+        self.fail_after = fail_after
+
+    def get_output(self, prompt):
+        self.count()
+        return prompt.upper()
+
+    def compare(self, instruction, first, second):
+        self.count()
+        # The longer output wins
+        return 0 if len(first) > len(second) else 1
+
+    def count(self):
+        if self.fail_after is not None and self.calls >= self.fail_after:
+            raise RuntimeError("crash")
+        self.calls += 1
+
+
+rows = [{"{{x}}": "a"}, {"{{x}}": "b"}, {"{{x}}": "a"}]
+
+
+def test_row_keys_follow_content():
+    keys = row_keys(rows)
+    assert len(set(keys)) == 3
+    assert row_keys(rows[1:])[0] == keys[1]
+    assert row_keys([{"{{x}}": "c"}])[0] != keys[0]
+
+
+def test_resume_after_crash_reuses_records(tmp_path):
+    path = str(tmp_path / "checkpoint.jsonl")
+    with pytest.raises(RuntimeError):
+        DatasetEvaluator(FakeRater(fail_after=5), max_workers=1, checkpoint_path=path)(
+            "{{x}}", ["long {{x}}"], rows
+        )
+    full = FakeRater()
+    expected = DatasetEvaluator(full, max_workers=1)("{{x}}", ["long {{x}}"], rows)
+    resumed = FakeRater()
+    results = DatasetEvaluator(resumed, max_workers=1, checkpoint_path=path)(
+        "{{x}}", ["long {{x}}"], rows
+    )
+    assert results == expected
+    assert resumed.calls == full.calls - 5
+
+
+def test_edited_rows_are_evaluated_again(tmp_path):
+    path = str(tmp_path / "checkpoint.jsonl")
+    DatasetEvaluator(FakeRater(), max_workers=1, checkpoint_path=path)(
+        "{{x}}", ["long {{x}}"], rows
+    )
+    rater = FakeRater()
+    DatasetEvaluator(rater, max_workers=1, checkpoint_path=path)(
+        "{{x}}", ["long {{x}}"], [rows[0], {"{{x}}": "edited"}, rows[2]]
+    )
+    # Two outputs and one verdict for the edited row only
+    assert rater.calls == 3
+
+
+def test_candidates_survive_reload(tmp_path):
+    path = str(tmp_path / "checkpoint.jsonl")
+    Checkpoint(path).put_candidates("key", ["one", "two"])
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"kind": "output"})[:10])
+    assert Checkpoint(path).candidates == {"key": ["one", "two"]}
+
+
+def test_wilson_interval():
+    assert wilson_interval(0, 0) == (0.0, 1.0)
+    low, high = wilson_interval(8, 10)
+    assert low < 0.8 < high
+
+
+def test_no_candidates_makes_no_calls():
+    rater = FakeRater()
+    evaluator = DatasetEvaluator(rater, max_workers=1)
+    assert evaluator("{{x}}", [], rows) == []
+    assert evaluator.race("{{x}}", [], rows) == {
+        "results": [],
+        "calls": 0,
+        "calls_saved": 0,
+    }
+    assert rater.calls == 0
+
+
+class NoisyRater(FakeRater):
+    # Candidate `cN` beats the baseline with chance 0.5 + (N / 10 - 0.5) / 2
+
+    both_orders = True
+
+    def __init__(self, seed):
+        super().__init__()
+        self.random = random.Random(seed)
+
+    def get_output(self, prompt):
+        self.count()
+        return prompt
+
+    def compare(self, instruction, first, second):
+        self.count()
+        quality = [
+            int(output[1]) / 10 if output.startswith("c") else 0.5
+            for output in (first, second)
+        ]
+        return 0 if self.random.random() < 0.5 + (quality[0] - quality[1]) / 2 else 1
+
+
+def test_race_drops_losers_early():
+    rater = NoisyRater(seed=1)
+    candidates = [f"c{i} {{{{x}}}}" for i in range(10)]
+    rows = [{"{{x}}": str(i)} for i in range(200)]
+    report = DatasetEvaluator(rater, max_workers=1).race("base {{x}}", candidates, rows)
+    # The simulated 10-candidate, 200-row run: 3464 of 6200 calls
+    assert report["calls"] == rater.calls == 3464
+    assert report["calls"] + report["calls_saved"] == 200 + 10 * 200 * 3
+    survivors = [result for result in report["results"] if not result["eliminated"]]
+    assert {result["prompt"][:2] for result in survivors} == {"c6", "c7", "c8", "c9"}
+    assert all(result["rows"] == 200 for result in survivors)
+    assert report["results"][-1]["rows"] == 16
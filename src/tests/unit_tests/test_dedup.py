@@ -0,0 +1,33 @@
+from dedup import MinHasher, cluster, normalize
+
+base = (
+    "Read the customer complaint in {{complaint}} and write a polite reply "
+    "that apologizes, explains the cause and offers a concrete next step."
+)
+
+
+def test_normalize():
+    assert normalize("  Hello\n\nWorld ") == "hello world"
+
+
+def test_layout_only_changes_share_a_cluster():
+    assert cluster([base, base.upper(), base.replace(" ", "\n")]) == [0, 0, 0]
+
+
+def test_near_duplicates_share_a_cluster():
+    near = base.replace("concrete next step", "concrete next step.")
+    different = "Translate the product description in {{text}} into French."
+    assert cluster([different, base, near]) == [0, 1, 1]
+
+
+def test_threshold():
+    edited = base.replace("polite reply", "short and friendly reply")
+    assert cluster([base, edited], threshold=0.99) == [0, 1]
+    assert cluster([base, edited], threshold=0.3) == [0, 0]
+
+
+def test_minhash_similarity():
+    hasher = MinHasher()
+    signature = hasher.signature(base)
+    assert hasher.similarity(signature, hasher.signature(base)) == 1.0
+    assert hasher.similarity(signature, hasher.signature("unrelated text")) < 0.2
@@ -0,0 +1,42 @@
+import pytest
+
+from lang_detect import cached_lang, detect_lang_local
+
+
+@pytest.mark.parametrize(
+    "text, lang",
+    [
+        ("请总结下面的文章，并给出三个要点。", "ch"),
+        ("请根据 {{document}} 写一份 <summary> 摘要 </summary>", "ch"),
+        ("Summarize the article below and list the three key points.", "en"),
+    ],
+)
+def test_confident_languages(text, lang):
+    detected, confidence = detect_lang_local(text)
+    assert detected == lang
+    assert confidence >= 0.8
+
+
+def test_other_latin_languages_have_low_confidence():
+    lang, confidence = detect_lang_local(
+        "Résume le texte suivant en trois phrases pour un lecteur pressé"
+    )
+    assert confidence < 0.5
+
+
+def test_variables_and_tags_are_ignored():
+    assert detect_lang_local("{{document}} <instructions></instructions>") == ("", 0.0)
+    assert detect_lang_local("") == ("", 0.0)
+
+
+def test_cached_lang_detects_once():
+    calls = []
+
+    def detect(text):
+        calls.append(text)
+        return "en"
+
+    text = "a prompt only used by this test"
+    assert cached_lang(text, detect) == "en"
+    assert cached_lang(text, detect) == "en"
+    assert calls == [text]
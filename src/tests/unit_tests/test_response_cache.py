@@ -0,0 +1,98 @@
+import io
+import json
+
+import pytest
+
+import bedrock
+import response_cache
+from response_cache import ResponseCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache.time, "time", clock)
+    return clock
+
+
+def test_key_ignores_dict_order():
+    assert ResponseCache.make_key("m", {"a": 1, "b": 2}) == ResponseCache.make_key(
+        "m", {"b": 2, "a": 1}
+    )
+    assert ResponseCache.make_key("m", {"a": 1}) != ResponseCache.make_key(
+        "other", {"a": 1}
+    )
+
+
+def test_round_trip_and_stats(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    assert cache.get("key") is None
+    cache.put("key", "m", {"content": [{"text": "hi"}]})
+    assert cache.get("key") == {"content": [{"text": "hi"}]}
+    assert cache.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5, "entries": 1}
+
+
+def test_entries_expire_after_ttl(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), ttl=60)
+    cache.put("key", "m", {"v": 1})
+    clock.now += 59
+    assert cache.get("key") == {"v": 1}
+    clock.now += 2
+    assert cache.get("key") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_is_evicted(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    cache.put("a", "m", 1)
+    clock.now += 1
+    cache.put("b", "m", 2)
+    clock.now += 1
+    # Reading "a" makes "b" the least recently used
+    assert cache.get("a") == 1
+    clock.now += 1
+    cache.put("c", "m", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_persists_across_instances(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    ResponseCache(path).put("key", "m", {"v": 1})
+    assert ResponseCache(path).get("key") == {"v": 1}
+
+
+class FakeClient:
+    def __init__(self):
+        self.calls = 0
+
+    def invoke_model(self, **kwargs):
+        self.calls += 1
+        body = {"content": [{"text": f"call {self.calls}"}], "usage": {}}
+        return {"body": io.BytesIO(json.dumps(body).encode())}
+
+
+@pytest.mark.parametrize(
+    "temperature, use_cache, cached",
+    [(0, None, True), (0.8, None, False), (0.8, True, True), (0, False, False)],
+)
+def test_invoke_model_caches_deterministic_calls(
+    tmp_path, monkeypatch, temperature, use_cache, cached
+):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    monkeypatch.setattr(bedrock, "get_response_cache", lambda: cache)
+    client = FakeClient()
+    body = {"messages": [], "temperature": temperature}
+    first = bedrock.invoke_model(client, body, "m", use_cache=use_cache)
+    second = bedrock.invoke_model(client, body, "m", use_cache=use_cache)
+    assert (first == second) is cached
+    assert client.calls == (1 if cached else 2)
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+import retrieval
+from retrieval import LexicalIndex
+
+documents = [
+    "Write a polite email to a customer about a late delivery.",
+    "Solve the math word problem step by step.",
+    "Summarize the legal contract for a lawyer.",
+]
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(retrieval, "cache_dir", str(tmp_path))
+    return tmp_path
+
+
+def test_search_ranks_matching_document_first():
+    index = LexicalIndex(documents)
+    assert index.search("customer email", top_k=1)[0][0] == 0
+
+
+def test_select_fills_top_k_with_unmatched_documents():
+    index = LexicalIndex(documents)
+    assert index.select("math problem", top_k=2) == [0, 1]
+    assert index.select("no shared terms", top_k=2) == [0, 1]
+    assert index.select("math problem", top_k=2, token_budget=15) == [1]
+
+
+def test_index_is_persisted_atomically(cache_dir):
+    LexicalIndex(documents, name="test")
+    files = os.listdir(cache_dir)
+    assert len(files) == 1 and files[0].endswith(".pkl")
+    reloaded = LexicalIndex(documents, name="test")
+    assert reloaded.search("legal contract", top_k=1)[0][0] == 2
+
+
+def test_corrupt_cache_file_is_rebuilt(cache_dir):
+    LexicalIndex(documents, name="test")
+    path = cache_dir / os.listdir(cache_dir)[0]
+    path.write_bytes(path.read_bytes()[:20])
+    index = LexicalIndex(documents, name="test")
+    assert index.search("legal contract", top_k=1)[0][0] == 2
+    assert LexicalIndex(documents, name="test").matrix.shape[0] == 3
+
+
+def test_cache_key_includes_sklearn_version(cache_dir, monkeypatch):
+    LexicalIndex(documents, name="test")
+    monkeypatch.setattr(retrieval.sklearn, "__version__", "0.0.0")
+    LexicalIndex(documents, name="test")
+    assert len(os.listdir(cache_dir)) == 2
@@ -0,0 +1,65 @@
+import pytest
+
+from semantic_cache import SemanticCache
+
+prompt = (
+    "You are a customer support agent for ACME. Read the complaint in "
+    "{{complaint}} and reply to the customer by email. Be polite, apologize "
+    "once, explain what went wrong and offer a concrete next step. Keep the "
+    "reply under 200 words and sign it as the ACME support team."
+)
+rewrite = "<role>ACME support agent</role> Reply politely to {{complaint}}."
+
+
+@pytest.fixture
+def cache():
+    cache = SemanticCache()
+    cache.put(prompt, rewrite, scope="en")
+    return cache
+
+
+def test_variable_name_whitespace_case_and_punctuation_hit(cache):
+    variant = (
+        prompt.replace("{{complaint}}", "{{ customer_message }}")
+        .replace(". ", ".\n\n")
+        .replace("Be polite,", "be polite;")
+    )
+    assert cache.get(variant, scope="en") == (
+        "<role>ACME support agent</role> Reply politely to {{customer_message}}."
+    )
+
+
+@pytest.mark.parametrize(
+    "edited",
+    [
+        prompt.replace("Be polite", "Never be polite"),
+        prompt.replace("polite", "rude"),
+        prompt.replace("ACME", "Globex"),
+    ],
+)
+def test_changed_instructions_miss(cache, edited):
+    assert cache.get(edited, scope="en") is None
+
+
+def test_scope_and_variable_count(cache):
+    assert cache.get(prompt, scope="ch") is None
+    assert cache.get(prompt + " {{extra}}", scope="en") is None
+    assert cache.get(prompt, scope="en") == rewrite
+
+
+def test_eviction_and_stats():
+    cache = SemanticCache(max_entries=1)
+    cache.put("first prompt about {{a}}", "one")
+    cache.put("second prompt about {{a}}", "two")
+    assert cache.get("first prompt about {{a}}") is None
+    assert cache.get("second prompt about {{b}}") == "two"
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+
+def test_ttl():
+    cache = SemanticCache(ttl=1)
+    cache.put("a prompt about {{a}}", "one")
+    for entry in cache.entries.values():
+        entry["created_at"] -= 2
+    assert cache.get("a prompt about {{a}}") is None
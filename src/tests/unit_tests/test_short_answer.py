@@ -0,0 +1,72 @@
+import pytest
+
+import short_answer
+from short_answer import (
+    ask_short_answer,
+    build_short_answer_body,
+    match_choice,
+    max_tokens_for,
+    parse_json_fields,
+)
+
+schema = {"Preferred": ["Response 1", "Response 2"]}
+
+
+def test_body_prefills_and_stops_at_the_closing_brace():
+    body = build_short_answer_body("Which is better?", schema)
+    assert body["messages"][-1] == {"role": "assistant", "content": "{"}
+    assert body["stop_sequences"] == ["}"]
+    assert body["temperature"] == 0
+    assert body["max_tokens"] == max_tokens_for(schema) < 30
+
+
+@pytest.mark.parametrize(
+    "text, fields",
+    [
+        ('{"Preferred": "Response 2"}', {"Preferred": "Response 2"}),
+        ('{"Preferred": "Response 2"', {"Preferred": "Response 2"}),
+        ('{"Preferred": "Response 2', {"Preferred": "Response 2"}),
+        (
+            '{"Preferred": "Response 1"} because it is shorter',
+            {"Preferred": "Response 1"},
+        ),
+        ('{"score": 7, "lang": "en"', {"score": "7", "lang": "en"}),
+        ("no json here", {}),
+    ],
+)
+def test_parse_json_fields(text, fields):
+    assert parse_json_fields(text) == fields
+
+
+@pytest.mark.parametrize(
+    "value, choice",
+    [
+        ("Response 2", "Response 2"),
+        ("response 1", "Response 1"),
+        ("2", "Response 2"),
+        ("Response 2.", "Response 2"),
+        ("Response 3", None),
+        ("both", None),
+        (None, None),
+    ],
+)
+def test_match_choice(value, choice):
+    assert match_choice(value, schema["Preferred"]) == choice
+
+
+def fake_invoke(text):
+    def invoke_model(client, body, model_id, use_cache=None):
+        return {"content": [{"text": text}]}
+
+    return invoke_model
+
+
+def test_ask_short_answer(monkeypatch):
+    monkeypatch.setattr(short_answer, "invoke_model", fake_invoke('"Preferred": "2"'))
+    assert ask_short_answer(None, "m", "?", schema) == {"Preferred": "Response 2"}
+
+
+def test_ask_short_answer_falls_back(monkeypatch):
+    monkeypatch.setattr(short_answer, "invoke_model", fake_invoke('"Preferred": "none'))
+    fallback = {"Preferred": "Response 1"}
+    assert ask_short_answer(None, "m", "?", schema, fallback=fallback) == fallback
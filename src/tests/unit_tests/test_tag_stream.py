@@ -0,0 +1,51 @@
+from tag_stream import TagStreamParser, extract_numbered_tags
+
+
+def feed_all(parser, deltas):
+    return [parser.feed(delta) for delta in deltas]
+
+
+def test_extracts_tag_split_across_deltas():
+    parser = TagStreamParser("answer")
+    emitted = feed_all(parser, ["before <ans", "wer>hel", "lo</an", "swer> after"])
+    assert "".join(emitted) == "hello"
+    assert parser.content == "hello"
+    assert parser.closed
+
+
+def test_holds_back_partial_closing_tag():
+    parser = TagStreamParser("answer", opened=True)
+    assert parser.feed("abc</ans") == "abc"
+    assert parser.feed("x") == "</ansx"
+    assert not parser.closed
+
+
+def test_only_first_occurrence():
+    parser = TagStreamParser("a")
+    feed_all(parser, ["<a>one</a><a>two</a>"])
+    assert parser.content == "one"
+    assert parser.feed("more") == ""
+
+
+def test_nothing_before_opening_tag():
+    parser = TagStreamParser("a")
+    assert parser.feed("no tag yet") == ""
+    assert not parser.opened
+
+
+def test_consume_closes_upstream_after_closing_tag():
+    read = []
+
+    def deltas():
+        for delta in ["<a>x", "y</a>", "never read"]:
+            read.append(delta)
+            yield delta
+
+    parser = TagStreamParser("a")
+    assert list(parser.consume(deltas())) == ["x", "y"]
+    assert read == ["<a>x", "y</a>"]
+
+
+def test_extract_numbered_tags():
+    text = "<r_1>one</r_1>\n<r_2>two\n<r_3>three"
+    assert extract_numbered_tags(text, "r", 4) == ["one", "two\n", "three", None]
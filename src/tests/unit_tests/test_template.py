@@ -0,0 +1,53 @@
+from template import Template, compile_template, render_prompt, variable_name
+
+
+def test_variable_name():
+    assert variable_name("{{document}}") == "document"
+    assert variable_name("{{ insert text here }}") == "insert text here"
+    assert variable_name("{$DOC}") == "DOC"
+    assert variable_name("{name}") == "name"
+    assert variable_name("document") == "document"
+
+
+def test_render_accepts_bare_and_placeholder_keys():
+    template = Template("Hi {{name}}, see {$DOC} and {topic}.")
+    assert template.variables == ["name", "DOC", "topic"]
+    assert (
+        template.render({"name": "Ann", "{$DOC}": "the doc", "{topic}": "cats"})
+        == "Hi Ann, see the doc and cats."
+    )
+
+
+def test_render_leaves_missing_placeholders():
+    assert render_prompt("{{a}} and {{b}}", {"a": 1}) == "1 and {{b}}"
+
+
+def test_values_are_not_substituted_again():
+    template = Template("{{a}} {{b}}")
+    assert template.render({"a": "{{b}}", "b": "x"}) == "{{b}} x"
+
+
+def test_repeated_variable():
+    template = Template("{{a}}-{{a}}")
+    assert template.variables == ["a"]
+    assert template.render_many([{"a": 1}, {"a": 2}]) == ["1-1", "2-2"]
+
+
+def test_missing_and_unused():
+    template = Template("{{a}} {{b}}")
+    assert template.missing({"{{a}}": "x"}) == ["b"]
+    assert template.unused({"a": "x", "{{c}}": "y"}) == ["{{c}}"]
+
+
+def test_rename_keeps_placeholder_syntax():
+    template = Template("{{ doc }} and {$doc} and {other}")
+    assert template.rename({"doc": "text"}) == "{{ text }} and {$text} and {other}"
+
+
+def test_json_braces_are_literal():
+    text = 'Return {"answer": 1} for {{question}}'
+    assert render_prompt(text, {"question": "q"}) == 'Return {"answer": 1} for q'
+
+
+def test_compile_template_is_cached():
+    assert compile_template("{{x}}") is compile_template("{{x}}")
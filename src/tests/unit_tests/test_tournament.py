@@ -0,0 +1,78 @@
+import pytest
+
+from tournament import Tournament, elo_update
+
+
+def by_strength(strengths):
+    # The stronger item always wins, whatever the order
+    def compare(i, j):
+        return 0 if strengths[i] > strengths[j] else 1
+
+    return compare
+
+
+def always_draw(i, j):
+    return None
+
+
+def first_position(i, j):
+    return 0
+
+
+@pytest.mark.parametrize("mode", ["knockout", "swiss", "round_robin"])
+@pytest.mark.parametrize("n", [2, 3, 5, 8])
+def test_strongest_item_ranks_first(mode, n):
+    strengths = [3, 7, 1, 9, 4, 8, 2, 6][:n]
+    tournament = Tournament(by_strength(strengths), mode=mode, max_workers=2)
+    ranking = tournament.rank(n)
+    assert sorted(ranking) == list(range(n))
+    assert ranking[0] == strengths.index(max(strengths))
+
+
+@pytest.mark.parametrize("mode", ["knockout", "swiss", "round_robin"])
+@pytest.mark.parametrize("n", [2, 3, 4, 5, 7])
+def test_draws_keep_the_first_seed_on_top(mode, n):
+    ranking = Tournament(always_draw, mode=mode).rank(n)
+    assert ranking[0] == 0
+
+
+@pytest.mark.parametrize("n, expected", [(3, [0, 2, 1]), (5, [0, 4, 2, 1, 3])])
+def test_knockout_bye_does_not_win_draws(n, expected):
+    assert Tournament(always_draw, mode="knockout").rank(n) == expected
+
+
+def test_both_orders_turns_position_bias_into_draws():
+    tournament = Tournament(first_position, mode="knockout", both_orders=True)
+    assert tournament.play([(0, 1), (2, 3)]) == [None, None]
+    one_order = Tournament(first_position, mode="knockout", both_orders=False)
+    assert one_order.play([(0, 1), (3, 2)]) == [0, 3]
+
+
+@pytest.mark.parametrize("mode", ["knockout", "swiss", "round_robin"])
+@pytest.mark.parametrize("both_orders", [True, False])
+@pytest.mark.parametrize("n", [1, 2, 5, 8])
+def test_comparisons_needed_matches_calls(mode, both_orders, n):
+    calls = []
+
+    def compare(i, j):
+        calls.append((i, j))
+        return 0
+
+    tournament = Tournament(compare, mode=mode, both_orders=both_orders)
+    tournament.rank(n)
+    assert len(calls) == tournament.comparisons == tournament.comparisons_needed(n)
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        Tournament(always_draw, mode="ladder")
+
+
+def test_elo_update_is_zero_sum():
+    ratings = [1000.0, 1200.0]
+    elo_update(ratings, 0, 1)
+    assert ratings[0] > 1000.0
+    assert sum(ratings) == pytest.approx(2200.0)
+    ratings = [1000.0, 1000.0]
+    elo_update(ratings, 0, 1, draw=True)
+    assert ratings == [1000.0, 1000.0]
@@ -0,0 +1,44 @@
+from usage import Budget, UsageMeter, record_usage, track_usage
+
+
+def test_track_usage_scopes_meters():
+    with track_usage() as outer:
+        record_usage("model", {"input_tokens": 10, "output_tokens": 5})
+        with track_usage() as inner:
+            record_usage("model", {"input_tokens": 1}, cached_response=True)
+    record_usage("model", {"input_tokens": 100})
+    assert outer.snapshot()["calls"] == 1
+    assert outer.snapshot()["total_tokens"] == 15
+    assert inner.snapshot()["calls"] == 0
+    assert inner.snapshot()["cached_responses"] == 1
+
+
+def test_cache_read_ratio():
+    meter = UsageMeter()
+    meter.record({"input_tokens": 10, "cache_read_input_tokens": 30})
+    assert meter.snapshot()["cache_read_ratio"] == 0.75
+
+
+def test_budget_fit_caps_the_next_step():
+    budget = Budget(max_calls=10)
+    with track_usage(budget.meter):
+        for _ in range(3):
+            record_usage("model", {})
+    assert budget.remaining_calls() == 7
+    # Each item costs two calls plus a fixed one
+    assert budget.fit(5, lambda n: 2 * n + 1) == 3
+    assert budget.fit(5, lambda n: 8 * n) == 0
+    assert not budget.exhausted()
+
+
+def test_unlimited_budget():
+    budget = Budget()
+    assert budget.remaining_calls() is None
+    assert budget.fit(4, lambda n: 1000 * n) == 4
+
+
+def test_token_budget():
+    budget = Budget(max_tokens=20)
+    with track_usage(budget.meter):
+        record_usage("model", {"input_tokens": 15, "output_tokens": 5})
+    assert budget.exhausted()
@@ -0,0 +1,93 @@
+from validators import (
+    CandidateValidator,
+    LengthRatio,
+    NearDuplicate,
+    balanced_xml,
+    keeps_examples,
+    keeps_variables,
+    unbalanced_tags,
+)
+
+
+def context(initial_prompt, variables=(), accepted=()):
+    return {
+        "initial_prompt": initial_prompt,
+        "variables": list(variables),
+        "accepted": list(accepted),
+    }
+
+
+def test_unbalanced_tags():
+    assert unbalanced_tags("<a><b/>text</a>") == []
+    assert unbalanced_tags("<a><b>text</a>") == ["b"]
+    assert unbalanced_tags("text</a>") == ["a"]
+    assert unbalanced_tags("<a>text") == ["a"]
+
+
+def test_keeps_variables():
+    initial = "Summarize {{document}}"
+    assert (
+        keeps_variables("Read {{document}} and summarize it", context(initial)) is None
+    )
+    assert "document" in keeps_variables("Summarize the text", context(initial))
+    assert "{{tone}}" in keeps_variables(
+        "Summarize {{document}}", context(initial, variables=["{{tone}}"])
+    )
+
+
+def test_balanced_xml_only_when_initial_is_balanced():
+    assert balanced_xml("<doc>{{x}}", context("<doc>{{x}}</doc>"))
+    assert balanced_xml("<doc>{{x}}</doc>", context("<doc>{{x}}</doc>")) is None
+    assert balanced_xml("<doc>{{x}}", context("<doc>{{x}}")) is None
+
+
+def test_keeps_examples_ignores_whitespace():
+    initial = "Classify.\n<example>great   film -> positive</example>"
+    assert (
+        keeps_examples("<example>great film\n-> positive</example>", context(initial))
+        is None
+    )
+    assert keeps_examples("Classify the review.", context(initial))
+
+
+def test_length_ratio_lets_short_prompts_grow():
+    validator = LengthRatio()
+    initial = "Write a haiku about {{topic}}"
+    assert validator("x" * 2000, context(initial)) is None
+    assert validator("x" * 9000, context(initial))
+    assert validator("x" * 10, context(initial))
+    long_initial = "y" * 2000
+    assert validator("x" * 16000, context(long_initial)) is None
+    assert validator("x" * 16001, context(long_initial))
+
+
+def test_near_duplicate():
+    validator = NearDuplicate(threshold=0.9)
+    accepted = ["Summarize the report in three short bullet points for managers"]
+    assert validator(accepted[0] + ".", context("", accepted=accepted))
+    assert (
+        validator("Translate the report into French", context("", accepted=accepted))
+        is None
+    )
+
+
+def test_candidate_validator_checks_against_accepted():
+    initial = "Summarize {{document}} for a busy executive in a few sentences."
+    good = "Read {{document}} and summarize it for a busy executive in three sentences."
+    passed, rejected = CandidateValidator()(
+        [good, good, "Summarize the text.", "<a>{{document}} summary for executives"],
+        initial,
+    )
+    assert passed == [good]
+    assert [reason for _, reason in rejected] == [
+        "near duplicate of another candidate",
+        "lost variables document",
+        "unbalanced xml tags a",
+    ]
+
+
+def test_custom_validators():
+    passed, rejected = CandidateValidator([lambda candidate, context: None])(
+        ["anything"], "initial"
+    )
+    assert passed == ["anything"] and rejected == []
@@ -1,42 +1,164 @@
 import json
+import logging
 import os
+import re
 
-import boto3
-from botocore.config import Config
 from dotenv import load_dotenv
 
+from bedrock import (
+    cacheable_prefix_content,
+    get_bedrock_client,
+    invoke_model,
+    invoke_model_stream,
+)
+from concurrency import bounded_map
+from dedup import cluster
+from guide import resolve_guide_variant, select_guide
+from lang_detect import cached_lang, detect_lang_local
+from semantic_cache import SemanticCache
+from short_answer import ask_short_answer
+from tag_stream import extract_numbered_tags
+
 load_dotenv()
 
-# Get the directory where the current script is located
-current_script_path = os.path.dirname(os.path.abspath(__file__))
+logger = logging.getLogger(__name__)
 
-# Construct the full path to the file
-prompt_guide_path = os.path.join(current_script_path, "PromptGuide.md")
+# Static leading parts of the rewrite and judge requests, kept identical across
+# calls for the same guide so they can be served from the provider's prompt cache.
+rewrite_prompt_prefix = """
+You are a instruction engineer. Your task is to rewrite the initial instruction in <initial_instruction></initial_instruction> xml tag based on the suggestions in the instruction guide in <instruction_guide></instruction_guide> xml tag.
+This instruction is then sent to claude to get the expected output.
 
-# Open the file using the full path
-with open(prompt_guide_path, "r") as f:
-    PromptGuide = f.read()
+<instruction_guide>
+{guide}
+</instruction_guide>
+""".strip()
+
+judge_prompt_prefix = """
+You are a instruction engineer. Your task is to evaluate which of the instructions given below is better based on guide in <guide> xml tag.
+
+Instruction guide:
+<guide>
+{guide}
+</guide>
+""".strip()
 
 region_name = os.getenv("REGION_NAME")
+# Near-duplicate prompt cache for rewrites, see semantic_cache.SemanticCache
+semantic_cache_enabled = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+semantic_cache_threshold = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+semantic_cache_max_entries = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+semantic_cache_max_chars = int(os.getenv("SEMANTIC_CACHE_MAX_CHARS", "5000000"))
+semantic_cache_ttl = int(os.getenv("SEMANTIC_CACHE_TTL", str(24 * 3600)))
+# Below this local detector confidence detect_lang falls back to the model
+lang_confidence_threshold = float(os.getenv("LANG_DETECT_CONFIDENCE", "0.8"))
 
 
 class GuideBased:
     def __init__(self):
-        session = boto3.Session()
-        retry_config = Config(
-            region_name=region_name,
-            retries={
-                "max_attempts": 5,
-                "mode": "standard",
-            },
+        self.bedrock_client = get_bedrock_client(region_name)
+        self.rewrite_model_id = "anthropic.claude-3-5-sonnet-20240620-v1:0"  # anthropic.claude-3-sonnet-20240229-v1:0 "anthropic.claude-3-haiku-20240307-v1:0"
+        # Judge calls skipped because every candidate was a near duplicate
+        self.judge_calls_avoided = 0
+        self.semantic_cache = (
+            SemanticCache(
+                threshold=semantic_cache_threshold,
+                max_entries=semantic_cache_max_entries,
+                max_chars=semantic_cache_max_chars,
+                ttl=semantic_cache_ttl,
+            )
+            if semantic_cache_enabled
+            else None
         )
-        service_name = "bedrock-runtime"
-        self.bedrock_client = session.client(
-            service_name=service_name, config=retry_config
+
+    def __call__(self, initial_prompt, lang=None, use_cache=None, guide_variant=None):
+        # Callers rewriting the same prompt several times can detect once, and
+        # should pass use_cache=False to get distinct samples. The sampled
+        # rewrite stays out of the response cache by default, the semantic
+        # cache is skipped only with use_cache=False
+        if lang is None:
+            lang = self.detect_lang(initial_prompt)
+        scope = self.semantic_scope(initial_prompt, lang, guide_variant)
+        if use_cache is not False and self.semantic_cache is not None:
+            result = self.semantic_cache.get(initial_prompt, scope)
+            if result is not None:
+                return result
+        body = self.build_rewrite_body(initial_prompt, lang, guide_variant)
+        response_body = invoke_model(
+            self.bedrock_client, body, self.rewrite_model_id, use_cache=use_cache
         )
+        result = self.post_process(response_body["content"][0]["text"])
+        if use_cache is not False and self.semantic_cache is not None:
+            self.semantic_cache.put(initial_prompt, result, scope)
+        return result
 
-    def __call__(self, initial_prompt):
-        lang = self.detect_lang(initial_prompt)
+    def stream(self, initial_prompt, lang=None, use_cache=None, guide_variant=None):
+        """
+        Streaming variant of __call__: yields the rewrite as it is generated,
+        then the post-processed result.
+        """
+        if lang is None:
+            lang = self.detect_lang(initial_prompt)
+        scope = self.semantic_scope(initial_prompt, lang, guide_variant)
+        if use_cache is not False and self.semantic_cache is not None:
+            result = self.semantic_cache.get(initial_prompt, scope)
+            if result is not None:
+                yield result
+                return
+        body = self.build_rewrite_body(initial_prompt, lang, guide_variant)
+        result = ""
+        for delta in invoke_model_stream(
+            self.bedrock_client, body, self.rewrite_model_id, use_cache=use_cache
+        ):
+            result += delta
+            yield result
+        result = self.post_process(result)
+        if use_cache is not False and self.semantic_cache is not None:
+            self.semantic_cache.put(initial_prompt, result, scope)
+        yield result
+
+    def semantic_scope(self, initial_prompt, lang, guide_variant):
+        # Rewrites are only reused for the same language and guide
+        return (lang, resolve_guide_variant(guide_variant, initial_prompt))
+
+    def generate_batch(self, initial_prompt, n=3, lang=None, guide_variant=None):
+        """
+        Generate `n` rewrites with a single request, each returned in its own
+        numbered xml tag, so the guide and instruction are only sent once.
+        Candidates that are missing or lost a `{{variable}}` of the initial
+        prompt are retried one by one through __call__.
+        """
+        if lang is None:
+            lang = self.detect_lang(initial_prompt)
+        body = self.build_rewrite_body(initial_prompt, lang, guide_variant, n=n)
+        response_body = invoke_model(
+            self.bedrock_client, body, self.rewrite_model_id, use_cache=False
+        )
+        text = "<rewrite_1>" + response_body["content"][0]["text"]
+        candidates = [
+            self.post_process(candidate) if candidate else None
+            for candidate in extract_numbered_tags(text, "rewrite", n)
+        ]
+        variables = re.findall(r"\{\{[^{}]+\}\}", initial_prompt)
+        retry = [
+            idx
+            for idx, candidate in enumerate(candidates)
+            if not candidate or not all(variable in candidate for variable in variables)
+        ]
+        retried = bounded_map(
+            lambda _: self(
+                initial_prompt, lang=lang, use_cache=False, guide_variant=guide_variant
+            ),
+            retry,
+        )
+        for idx, candidate in zip(retry, retried):
+            candidates[idx] = candidate
+        return candidates
+
+    def build_rewrite_body(self, initial_prompt, lang=None, guide_variant=None, n=1):
+        guide = select_guide(guide_variant, initial_prompt)
+        if lang is None:
+            lang = self.detect_lang(initial_prompt)
         if "ch" in lang:
             lang_prompt = "Please use Chinese for rewriting. The xml tag name is still in English."
         elif "en" in lang:
@@ -44,21 +166,32 @@ class GuideBased:
         else:
             lang_prompt = "Please use same language as the initial instruction for rewriting. The xml tag name is still in English."
 
-        prompt = """
-You are a instruction engineer. Your task is to rewrite the initial instruction in <initial_instruction></initial_instruction> xml tag based on the suggestions in the instruction guide in <instruction_guide></instruction_guide> xml tag.
-This instruction is then sent to claude to get the expected output.
-
-<instruction_guide>
-{guide}
-</instruction_guide>
+        if n == 1:
+            output_rule = (
+                "Only output the rewrite instruction return them in "
+                "<rerwited></rerwited>XML tags"
+            )
+            assistant_partial = "<rerwited>"
+            stop_sequence = "</rerwited>"
+        else:
+            output_rule = (
+                f"Write {n} different rewrites of the initial instruction. "
+                "Only output the rewrite instructions and return each one in its "
+                "own numbered XML tag instead of <rerwited></rerwited>: "
+                "<rewrite_1></rewrite_1>, <rewrite_2></rewrite_2> and so on up to "
+                f"<rewrite_{n}></rewrite_{n}>"
+            )
+            assistant_partial = "<rewrite_1>"
+            stop_sequence = f"</rewrite_{n}>"
 
+        prompt = """
 You are a instruction engineer. Your task is to rewrite the initial instruction in <initial_instruction></initial_instruction> xml tag based on the suggestions in the instruction guide in <instruction_guide></instruction_guide> xml tag.
 This instruction is then sent to claude to get the expected output.
 
 Here are some important rules for rewrite:
 1. Something like `{{variable}}` is customizable text that will be replaced when sent to claude. It needs to be retained in the rewrite.
 2. {lang_prompt}
-3. Only output the rewrite instruction return them in <rerwited></rerwited>XML tags
+3. {output_rule}
 4. If examples are already included in the initial prompt, do not remove the examples after the rewrite.
 
 You are a instruction engineer. Your task is to rewrite the initial instruction in <initial_instruction></initial_instruction> xml tag based on the suggestions in the instruction guide in <instruction_guide></instruction_guide> xml tag.
@@ -114,32 +247,30 @@ If the question cannot be answered by the document, say "Cannot answer the quest
         messages = [
             {
                 "role": "user",
-                "content": prompt.format(
-                    guide=PromptGuide, initial=initial_prompt, lang_prompt=lang_prompt
+                "content": cacheable_prefix_content(
+                    rewrite_prompt_prefix.format(guide=guide),
+                    prompt.format(
+                        initial=initial_prompt,
+                        lang_prompt=lang_prompt,
+                        output_rule=output_rule,
+                    ),
                 ),
             },
-            {"role": "assistant", "content": "<rerwited>"},
+            {"role": "assistant", "content": assistant_partial},
         ]
-        body = json.dumps(
-            {
-                "messages": messages,
-                "max_tokens": 4096,
-                "temperature": 0.8,
-                "top_k": 50,
-                "top_p": 1,
-                "stop_sequences": ["</rerwited>"],
-                "anthropic_version": "bedrock-2023-05-31",
-            }
-        )
-        modelId = "anthropic.claude-3-5-sonnet-20240620-v1:0"  # anthropic.claude-3-sonnet-20240229-v1:0 "anthropic.claude-3-haiku-20240307-v1:0"
-        accept = "application/json"
-        contentType = "application/json"
-
-        response = self.bedrock_client.invoke_model(
-            body=body, modelId=modelId, accept=accept, contentType=contentType
-        )
-        response_body = json.loads(response.get("body").read())
-        result = response_body["content"][0]["text"].replace("</rewrite>", "").strip()
+        body = {
+            "messages": messages,
+            "max_tokens": 4096,
+            "temperature": 0.8,
+            "top_k": 50,
+            "top_p": 1,
+            "stop_sequences": [stop_sequence],
+            "anthropic_version": "bedrock-2023-05-31",
+        }
+        return body
+
+    def post_process(self, result):
+        result = result.replace("</rewrite>", "").strip()
         if result.startswith("<instruction>"):
             result = result[13:]
         if result.endswith("</instruction>"):
@@ -148,9 +279,19 @@ If the question cannot be answered by the document, say "Cannot answer the quest
         return result
 
     def detect_lang(self, initial_prompt):
+        return cached_lang(initial_prompt, self._detect_lang)
+
+    def _detect_lang(self, initial_prompt):
+        # Only ask the model when the character mix is ambiguous
+        lang, confidence = detect_lang_local(initial_prompt)
+        if confidence >= lang_confidence_threshold:
+            return lang
+        return self.detect_lang_llm(initial_prompt)
+
+    def detect_lang_llm(self, initial_prompt):
         lang_example = json.dumps({"lang": "ch"})
         prompt = """
-Please determine what language the document below is in? English (en) or Chinese (ch)?
+Please determine what language the document below is in? English (en), Chinese (ch) or another language (other)?
 
 <document>
 {document}
@@ -159,41 +300,48 @@ Please determine what language the document below is in? English (en) or Chinese
 Use JSON format with key `lang` when return result. Please only output the result in json format, and do the json format check and return, don't include other extra text! An example of output is as follows:
 Output example: {lang_example}
 """.strip()
-        messages = [
-            {
-                "role": "user",
-                "content": prompt.format(
-                    document=initial_prompt, lang_example=lang_example
-                ),
-            },
-            {"role": "assistant", "content": "{"},
-        ]
-        body = json.dumps(
-            {
-                "messages": messages,
-                "max_tokens": 1000,
-                "temperature": 0.8,
-                "top_k": 50,
-                "top_p": 1,
-                "stop_sequences": ["\n\nHuman:"],
-                "anthropic_version": "bedrock-2023-05-31",
-            }
-        )
         modelId = "anthropic.claude-3-sonnet-20240229-v1:0"
-        accept = "application/json"
-        contentType = "application/json"
-
-        response = self.bedrock_client.invoke_model(
-            body=body, modelId=modelId, accept=accept, contentType=contentType
+        # Without a readable answer keep the local detector's guess only when
+        # it is confident; "" (like "other") rewrites in the prompt's own
+        # language
+        lang, confidence = detect_lang_local(initial_prompt)
+        answer = ask_short_answer(
+            self.bedrock_client,
+            modelId,
+            prompt.format(document=initial_prompt, lang_example=lang_example),
+            {"lang": ["en", "ch", "other"]},
+            fallback={
+                "lang": lang if confidence >= lang_confidence_threshold else ""
+            },
         )
-        response_body = json.loads(response.get("body").read())
-        try:
-            lang = json.loads("{" + response_body["content"][0]["text"])["lang"]
-        except:
-            lang = ""
-        return lang
-
-    def judge(self, candidates):
+        return "" if answer["lang"] == "other" else answer["lang"]
+
+    def judge(self, candidates, guide_variant=None):
+        """
+        Return the index of the best candidate, or None when the verdict
+        cannot be parsed. Near-duplicate candidates (see dedup.cluster) are
+        judged once through their first member.
+        """
+        return self.judge_clusters(candidates, guide_variant)[0]
+
+    def judge_clusters(self, candidates, guide_variant=None):
+        """
+        Like judge, but also return the dedup.cluster assignment, so the
+        verdict can be carried over to every near duplicate of the winner.
+        """
+        assignment = cluster(candidates)
+        representatives = sorted(set(assignment))
+        if len(representatives) < len(candidates):
+            logger.info(
+                "Judging %d of %d candidates after dedup",
+                len(representatives),
+                len(candidates),
+            )
+        if len(representatives) == 1:
+            self.judge_calls_avoided += 1
+            return 0, assignment
+        candidates = [candidates[idx] for idx in representatives]
+        guide = select_guide(guide_variant, "\n".join(candidates))
         Instruction_prompts = []
         for idx, candidate in enumerate(candidates):
             Instruction_prompts.append(
@@ -201,57 +349,28 @@ Output example: {lang_example}
             )
         example = json.dumps({"Preferred": "Instruction 1"})
         prompt = """
-You are a instruction engineer. Your task is to evaluate which of the three instructions given below is better based on guide in <guide> xml tag.
-
-Instruction guide:
-<guide>
-{guide}
-</guide>
-
-You are a instruction engineer. Your task is to evaluate which of the three instructions given below is better based on guide in <guide> xml tag.
+You are a instruction engineer. Your task is to evaluate which of the {count} instructions given below is better based on guide in <guide> xml tag.
 
 {Instruction_prompts}
 
 Use JSON format when returning results. Please only output the result in json format, and do the json format check and return, don't include other extra text! An example of output is as follows:
 {example}
 """.strip()
-        messages = [
-            {
-                "role": "user",
-                "content": prompt.format(
-                    guide=PromptGuide,
+        modelId = "anthropic.claude-3-haiku-20240307-v1:0"  # anthropic.claude-3-sonnet-20240229-v1:0
+        choices = [f"Instruction {idx + 1}" for idx in range(len(candidates))]
+        answer = ask_short_answer(
+            self.bedrock_client,
+            modelId,
+            cacheable_prefix_content(
+                judge_prompt_prefix.format(guide=guide),
+                prompt.format(
+                    count=len(candidates),
                     Instruction_prompts="\n\n".join(Instruction_prompts),
                     example=example,
                 ),
-            },
-            {"role": "assistant", "content": "{"},
-        ]
-        body = json.dumps(
-            {
-                "messages": messages,
-                "max_tokens": 128,
-                "temperature": 0.1,
-                "top_k": 50,
-                "top_p": 1,
-                "stop_sequences": ["\n\nHuman:"],
-                "anthropic_version": "bedrock-2023-05-31",
-            }
-        )
-        modelId = "anthropic.claude-3-haiku-20240307-v1:0"  # anthropic.claude-3-sonnet-20240229-v1:0
-        accept = "application/json"
-        contentType = "application/json"
-
-        response = self.bedrock_client.invoke_model(
-            body=body, modelId=modelId, accept=accept, contentType=contentType
+            ),
+            {"Preferred": choices},
         )
-        response_body = json.loads(response.get("body").read())
-        final_result = None
-        try:
-            result = json.loads("{" + response_body["content"][0]["text"])
-            for idx in range(3):
-                if str(idx + 1) in result["Preferred"]:
-                    final_result = idx
-                    break
-        except:
-            pass
-        return final_result
+        if answer is None:
+            return None, assignment
+        return representatives[choices.index(answer["Preferred"])], assignment
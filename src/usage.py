@@ -0,0 +1,144 @@
+import contextlib
+import contextvars
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+usage_fields = (
+    "input_tokens",
+    "output_tokens",
+    "cache_read_input_tokens",
+    "cache_creation_input_tokens",
+)
+
+
+class UsageMeter:
+    """
+    Thread-safe running totals of model calls and the token counts reported in
+    the response `usage` block, including prompt-cache reads and writes.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.calls = 0
+            self.cached_responses = 0
+            self.totals = {field: 0 for field in usage_fields}
+
+    def record(self, usage, cached_response=False):
+        with self.lock:
+            if cached_response:
+                # Served from the response cache, no model call was made
+                self.cached_responses += 1
+                return
+            self.calls += 1
+            for field in usage_fields:
+                self.totals[field] += usage.get(field) or 0
+
+    def snapshot(self):
+        with self.lock:
+            snapshot = dict(self.totals)
+            snapshot["calls"] = self.calls
+            snapshot["cached_responses"] = self.cached_responses
+        # input_tokens only counts tokens after the last cache breakpoint
+        prompt_tokens = (
+            snapshot["input_tokens"]
+            + snapshot["cache_read_input_tokens"]
+            + snapshot["cache_creation_input_tokens"]
+        )
+        snapshot["total_tokens"] = prompt_tokens + snapshot["output_tokens"]
+        snapshot["cache_read_ratio"] = (
+            snapshot["cache_read_input_tokens"] / prompt_tokens
+            if prompt_tokens
+            else 0.0
+        )
+        return snapshot
+
+
+# Process-wide totals, plus any meters opened with track_usage() in the current
+# context (thread pools started with concurrency.bounded_map inherit them).
+usage_meter = UsageMeter()
+_scoped_meters = contextvars.ContextVar("scoped_meters", default=())
+
+
+def record_usage(model_id, usage, cached_response=False):
+    usage = usage or {}
+    logger.debug(
+        "%s usage: input=%s cache_read=%s cache_write=%s output=%s cached=%s",
+        model_id,
+        usage.get("input_tokens"),
+        usage.get("cache_read_input_tokens"),
+        usage.get("cache_creation_input_tokens"),
+        usage.get("output_tokens"),
+        cached_response,
+    )
+    usage_meter.record(usage, cached_response)
+    for meter in _scoped_meters.get():
+        meter.record(usage, cached_response)
+
+
+@contextlib.contextmanager
+def track_usage(meter=None):
+    """
+    Collect the usage of every model call made inside the block:
+
+        with track_usage() as meter:
+            rewrite(prompt)
+        print(meter.snapshot())
+    """
+    meter = meter or UsageMeter()
+    token = _scoped_meters.set(_scoped_meters.get() + (meter,))
+    try:
+        yield meter
+    finally:
+        _scoped_meters.reset(token)
+
+
+class Budget:
+    """
+    A cap on model calls and/or total tokens, metered with track_usage:
+
+        budget = Budget(max_calls=40)
+        with track_usage(budget.meter):
+            while not budget.exhausted():
+                ...
+
+    Calls already in flight when the cap is reached still complete, so loops
+    should check exhausted() before starting each batch of work. To keep
+    max_calls a hard cap, size each batch with fit() before starting it.
+    """
+
+    def __init__(self, max_calls=None, max_tokens=None):
+        self.max_calls = max_calls
+        self.max_tokens = max_tokens
+        self.meter = UsageMeter()
+
+    def exhausted(self):
+        snapshot = self.meter.snapshot()
+        if self.max_calls is not None and snapshot["calls"] >= self.max_calls:
+            return True
+        if (
+            self.max_tokens is not None
+            and snapshot["total_tokens"] >= self.max_tokens
+        ):
+            return True
+        return False
+
+    def remaining_calls(self):
+        if self.max_calls is None:
+            return None
+        return max(0, self.max_calls - self.meter.snapshot()["calls"])
+
+    def fit(self, limit, cost):
+        """
+        Largest n <= `limit` whose worst-case call count `cost(n)` fits in the
+        calls left, 0 when even n=1 does not.
+        """
+        remaining = self.remaining_calls()
+        if remaining is None:
+            return limit
+        return next((n for n in range(limit, 0, -1) if cost(n) <= remaining), 0)
@@ -0,0 +1,139 @@
+import logging
+import re
+
+from similarity import rouge_l
+from template import compile_template
+
+logger = logging.getLogger(__name__)
+
+tag_pattern = re.compile(r"<(/?)([A-Za-z_][\w.-]*)[^<>]*?(/?)>")
+example_pattern = re.compile(
+    r"<(example\w*)[^<>]*>(.*?)</\1>", re.DOTALL | re.IGNORECASE
+)
+
+
+def unbalanced_tags(text):
+    """Return the xml tag names that are not properly opened and closed."""
+    stack = []
+    unbalanced = []
+    for match in tag_pattern.finditer(text):
+        closing, name, self_closing = match.groups()
+        if self_closing:
+            continue
+        if not closing:
+            stack.append(name)
+        elif name in stack:
+            # Anything opened after `name` was left unclosed
+            while stack[-1] != name:
+                unbalanced.append(stack.pop())
+            stack.pop()
+        else:
+            unbalanced.append(name)
+    return unbalanced + stack
+
+
+def normalize_whitespace(text):
+    return " ".join(text.split())
+
+
+def keeps_variables(candidate, context):
+    template = compile_template(candidate)
+    required = compile_template(context["initial_prompt"]).variables + list(
+        context["variables"]
+    )
+    missing = template.unused(required)
+    if missing:
+        return f"lost variables {', '.join(dict.fromkeys(missing))}"
+
+
+def balanced_xml(candidate, context):
+    # Only hold candidates to it when the initial prompt was balanced itself
+    if unbalanced_tags(context["initial_prompt"]):
+        return None
+    unbalanced = unbalanced_tags(candidate)
+    if unbalanced:
+        return f"unbalanced xml tags {', '.join(dict.fromkeys(unbalanced))}"
+
+
+def keeps_examples(candidate, context):
+    text = normalize_whitespace(candidate)
+    for _, example in example_pattern.findall(context["initial_prompt"]):
+        if normalize_whitespace(example) not in text:
+            return "dropped an example of the initial prompt"
+
+
+class LengthRatio:
+    # Short prompts are expected to grow a lot, so the upper bound is taken
+    # relative to at least `floor` characters
+    def __init__(self, min_ratio=0.5, max_ratio=8.0, floor=1000):
+        self.min_ratio = min_ratio
+        self.max_ratio = max_ratio
+        self.floor = floor
+
+    def __call__(self, candidate, context):
+        initial_length = len(context["initial_prompt"])
+        ratio = len(candidate) / max(1, initial_length)
+        if ratio < self.min_ratio:
+            return f"length ratio {ratio:.2f} below {self.min_ratio}"
+        if len(candidate) > self.max_ratio * max(initial_length, self.floor):
+            return f"length ratio {ratio:.2f} above {self.max_ratio}"
+
+
+class NearDuplicate:
+    def __init__(self, threshold=0.95):
+        self.threshold = threshold
+
+    def __call__(self, candidate, context):
+        for accepted in context["accepted"]:
+            if rouge_l(accepted, candidate) >= self.threshold:
+                return "near duplicate of another candidate"
+
+
+default_validators = [
+    keeps_variables,
+    balanced_xml,
+    keeps_examples,
+    LengthRatio(),
+    NearDuplicate(),
+]
+
+
+class CandidateValidator:
+    """
+    Local checks run on candidate prompts before any model call is spent on
+    them. Each validator is a callable `(candidate, context)` returning None
+    to accept or the rejection reason; `context` holds the `initial_prompt`,
+    extra required `variables` and the candidates `accepted` so far (checked
+    first, e.g. the incumbent).
+    """
+
+    def __init__(self, validators=None):
+        self.validators = list(default_validators if validators is None else validators)
+
+    def __call__(self, candidates, initial_prompt, variables=(), accepted=()):
+        """Return the accepted candidates and `(candidate, reason)` rejections."""
+        context = {
+            "initial_prompt": initial_prompt,
+            "variables": variables,
+            "accepted": list(accepted),
+        }
+        passed = []
+        rejected = []
+        for candidate in candidates:
+            reason = next(
+                (
+                    reason
+                    for reason in (
+                        validator(candidate, context) for validator in self.validators
+                    )
+                    if reason
+                ),
+                None,
+            )
+            if reason:
+                logger.info("Rejected candidate prompt: %s", reason)
+                rejected.append((candidate, reason))
+                continue
+            passed.append(candidate)
+            context["accepted"].append(candidate)
+        return passed, rejected